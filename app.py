@@ -2,10 +2,15 @@
 
 import streamlit as st
 import json
-from backend.ocr_service import extract_text_aws, pdf_to_image
-from backend.llm_service import validate_text_with_llm
-from backend.db_service import save_results, load_results
-from backend.image_detecter import detect_kosher_symbol
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from backend.db_service import RESULTS_STORE, file_hash
+from backend.metrics import METRICS, Trace
+from backend.ocr_service import get_textract_client
+from backend.pipeline import analyze_document, stream_document_validation
 
 # --------------------------
 # Page Config
@@ -122,27 +127,99 @@ st.markdown(
     unsafe_allow_html=True
 )
 
+# --------------------------
+# Shared resources and per-session scratch files
+# --------------------------
+# Uploads are written under a per-session directory, named by content hash,
+# so sessions never overwrite each other and reruns never rewrite the file.
+# Streamlit has no session-end hook: a session's previous upload is removed
+# when it uploads another file, and session directories untouched for
+# UPLOAD_MAX_AGE seconds are removed when a new session starts.
+UPLOAD_ROOT = os.path.join(tempfile.gettempdir(), "bazooka_uploads")
+UPLOAD_MAX_AGE = int(os.getenv("UPLOAD_MAX_AGE", 24 * 3600))
+
+
+@st.cache_resource
+def shared_textract_client():
+    return get_textract_client()
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def cached_analysis(content_hash, _file_path, _pages_dir):
+    """
+    OCR and symbol detection for one upload, computed once per file content
+    (content_hash) and shared by every session and rerun. The paths are
+    left out of the cache key (leading underscore): they sit in each
+    session's own directory, so "image_paths" in a shared result can point
+    into the session that first analyzed the file. "analyzed_at" tells a
+    caller whether this call ran the analysis or got a cached copy.
+    """
+    analysis = analyze_document(_file_path, _pages_dir, ocr_kwargs={"client": shared_textract_client()})
+    analysis["analyzed_at"] = time.time()
+    return analysis
+
+
+def remove_stale_sessions(max_age=UPLOAD_MAX_AGE):
+    """Delete session directories under UPLOAD_ROOT not modified for `max_age` seconds."""
+    now = time.time()
+    for name in os.listdir(UPLOAD_ROOT):
+        path = os.path.join(UPLOAD_ROOT, name)
+        try:
+            stale = name.startswith("session_") and now - os.path.getmtime(path) > max_age
+        except FileNotFoundError:
+            continue
+        if stale:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def remove_upload(path):
+    """Delete an upload with the files derived from it (Textract store, rendered pages)."""
+    stem = os.path.splitext(path)[0]
+    shutil.rmtree(stem + "_pages", ignore_errors=True)
+    directory = os.path.dirname(path)
+    for name in os.listdir(directory) if os.path.isdir(directory) else []:
+        if name.startswith(os.path.basename(stem) + "."):
+            os.remove(os.path.join(directory, name))
+
+
+def session_upload_path(uploaded_file):
+    """
+    Write the upload to this session's scratch directory, once per upload,
+    replacing the session's previous upload.
+    Returns (file path, content hash).
+    """
+    saved = st.session_state.get("saved_upload")
+    if saved and saved["file_id"] == uploaded_file.file_id and os.path.exists(saved["path"]):
+        return saved["path"], saved["hash"]
+
+    if not os.path.isdir(st.session_state.get("session_dir", "")):
+        os.makedirs(UPLOAD_ROOT, exist_ok=True)
+        remove_stale_sessions()
+        st.session_state["session_dir"] = tempfile.mkdtemp(prefix="session_", dir=UPLOAD_ROOT)
+
+    file_bytes = uploaded_file.getvalue()
+    content_hash = file_hash(file_bytes)
+    extension = os.path.splitext(uploaded_file.name)[1].lower()
+    path = os.path.join(st.session_state["session_dir"], content_hash + extension)
+    if saved and saved["path"] != path:
+        remove_upload(saved["path"])
+    if not os.path.exists(path):
+        with open(path, "wb") as f:
+            f.write(file_bytes)
+    st.session_state["saved_upload"] = {"file_id": uploaded_file.file_id, "path": path, "hash": content_hash}
+    return path, content_hash
+
+
 def display_validation_report(result_data):
     """Display validation results as a formatted report"""
     
-    # Parse validation JSON
-    try:
-        if isinstance(result_data['validation'], str):
-            # If validation is a string, try to extract JSON from it
-            validation_text = result_data['validation']
-            # Find JSON content between ```json and ```
-            start = validation_text.find('```json\n') + 8
-            end = validation_text.find('\n```', start)
-            if start > 7 and end > start:
-                validation_json = validation_text[start:end]
-            else:
-                validation_json = validation_text
-            validation_data = json.loads(validation_json)
-        else:
-            validation_data = result_data['validation']
-    except:
-        st.error("❌ Could not parse validation results")
-        return
+    validation = result_data['validation']
+    if validation.error:
+        st.error(f"❌ Could not read validation results: {validation.error}")
+        if not validation.checks:
+            return
+    for warning in validation.warnings:
+        st.warning(f"⚠️ {warning}")
     
     # Report Header
     st.markdown(f"""
@@ -154,9 +231,9 @@ def display_validation_report(result_data):
     """, unsafe_allow_html=True)
     
     # Summary Statistics
-    checks = validation_data.get('checks', [])
-    passed_checks = [c for c in checks if c.get('result') == 'PASS']
-    failed_checks = [c for c in checks if c.get('result') == 'FAIL']
+    checks = validation.checks
+    passed_checks = validation.passed
+    failed_checks = validation.failed
     
     col1, col2, col3 = st.columns(3)
     with col1:
@@ -178,9 +255,9 @@ def display_validation_report(result_data):
         for check in failed_checks:
             st.markdown(f"""
             <div class='check-item fail'>
-                <strong>{check.get('rule', 'Unknown Rule')}</strong><br>
+                <strong>{check.rule or 'Unknown Rule'}</strong><br>
                 <span class='status-fail'>FAIL</span><br>
-                <em>{check.get('reason', 'No reason provided')}</em>
+                <em>{check.reason or 'No reason provided'}</em>
             </div>
             """, unsafe_allow_html=True)
     
@@ -190,22 +267,21 @@ def display_validation_report(result_data):
         for check in passed_checks:
             st.markdown(f"""
             <div class='check-item pass'>
-                <strong>{check.get('rule', 'Unknown Rule')}</strong><br>
+                <strong>{check.rule or 'Unknown Rule'}</strong><br>
                 <span class='status-pass'>PASS</span><br>
-                <em>{check.get('reason', 'No reason provided')}</em>
+                <em>{check.reason or 'No reason provided'}</em>
             </div>
             """, unsafe_allow_html=True)
     
     # Text Quality Issues Section
-    spelling_grammar = validation_data.get('spelling_grammar', {})
-    issues = spelling_grammar.get('issues', [])
+    issues = validation.issues
     
     if issues:
         st.markdown("### 📝 Text Corrections Required")
         for issue in issues:
             st.markdown(f"""
             <div class='error-item'>
-                <strong>Error:</strong> "{issue.get('ocr_text', '')}" → <strong>"{issue.get('correct_text', '')}"</strong>
+                <strong>Error:</strong> "{issue.ocr_text}" → <strong>"{issue.correct_text}"</strong>
             </div>
             """, unsafe_allow_html=True)
     else:
@@ -217,11 +293,11 @@ def display_validation_report(result_data):
         action_count = 1
         
         for check in failed_checks:
-            st.markdown(f"{action_count}. Fix: {check.get('rule', 'Unknown requirement')}")
+            st.markdown(f"{action_count}. Fix: {check.rule or 'Unknown requirement'}")
             action_count += 1
             
         for issue in issues:
-            st.markdown(f"{action_count}. Correct: '{issue.get('ocr_text', '')}' to '{issue.get('correct_text', '')}'")
+            st.markdown(f"{action_count}. Correct: '{issue.ocr_text}' to '{issue.correct_text}'")
             action_count += 1
 
 # --------------------------
@@ -256,39 +332,80 @@ with cols[1]:
 if uploaded_file:
     st.success(f"✅ File **{uploaded_file.name}** uploaded successfully!")
 
-    # Save uploaded file locally
-    with open("temp.pdf" if uploaded_file.name.endswith(".pdf") else "temp.png", "wb") as f:
-        f.write(uploaded_file.read())
-    file_path = f.name
+    file_path, content_hash = session_upload_path(uploaded_file)
 
     if st.button("🚀 Run", use_container_width=True):
-        # OCR
-        with st.spinner("🔍 Extracting text..."):
-            if file_path.endswith(".pdf"):
-                image_path = pdf_to_image(file_path, "temp.png")
-            else:
-                image_path = file_path
-            ocr_text = extract_text_aws(image_path)
+        # Spans from this run (including worker threads) land in run_trace.
+        run_trace = Trace(uploaded_file.name)
+
+        # OCR and Kosher symbol detection run side by side
+        with st.spinner("🔍 Extracting text and detecting Kosher symbols..."), run_trace.active():
+            analysis_started = time.time()
+            analysis = cached_analysis(content_hash, file_path, os.path.splitext(file_path)[0] + "_pages")
+        analysis_cached = analysis["analyzed_at"] < analysis_started
+        ocr_text = analysis["ocr_text"]
+        symbols_result = analysis["symbols"]
 
         with st.expander("📝 View OCR Extracted Text"):
             st.text_area("OCR Output", ocr_text, height=180)
 
-         # ✅ Kosher Symbol Detection
-        with st.spinner("🔍 Detecting Kosher Symbols..."):
-            symbols_result = detect_kosher_symbol(image_path)
-        
         st.subheader("🔯 Kosher Symbol Detection")
-        if symbols_result and "symbol" in symbols_result[0]:
+        if symbols_result:
             for sym in symbols_result:
                 st.success(f"Found: {sym['symbol']} (confidence {sym['confidence']:.2f})")
-            # Append detection info to OCR text for AI validation
-            ocr_text += "\nKosher symbol detected"
         else:
             st.info("No Kosher symbols detected")    
 
         # Validation
-        with st.spinner("🤖 Validating..."):
-            validation_result = validate_text_with_llm(ocr_text, check_group)
+        # Render each check as soon as it arrives; the full report replaces
+        # this live list once the model finishes.
+        live_checks = st.empty()
+        live_list = live_checks.container()
+        with st.spinner("🤖 Validating..."), run_trace.active():
+            for kind, item in stream_document_validation(analysis, check_group):
+                if kind == "check":
+                    icon = "✅" if item.passed else "❌"
+                    live_list.markdown(f"{icon} **{item.result}** — {item.rule}")
+                else:
+                    validation_result = item
+        live_checks.empty()
+
+        # Analysis stage times of a cached result are from the run that
+        # filled the cache; only validation ran just now.
+        timings = analysis["timings"]
+        stages = ("validation",) if analysis_cached else ("rasterize", "ocr", "detection", "analyze", "validation")
+        st.caption(
+            "⏱️ "
+            + ("analysis cached · " if analysis_cached else "")
+            + " · ".join(f"{stage} {timings[stage]:.1f}s" for stage in stages if stage in timings)
+        )
+
+        with st.expander("⏱️ Timing breakdown"):
+            trace_rows = run_trace.summary()
+            if trace_rows:
+                st.table([
+                    {"Span": row["span"], "Calls": row["count"],
+                     "Total (s)": f"{row['total_s']:.3f}", "Max (s)": f"{row['max_s']:.3f}"}
+                    for row in trace_rows
+                ])
+            else:
+                st.caption("OCR and detection were served from cache.")
+            if run_trace.counters:
+                st.caption(" · ".join(f"{name}: {value}" for name, value in run_trace.counters.items()))
+            trace_cols = st.columns(2)
+            with trace_cols[0]:
+                st.download_button("Download trace (JSON)", run_trace.to_json(),
+                                   file_name=f"trace_{uploaded_file.name}.json", mime="application/json")
+            with trace_cols[1]:
+                st.download_button("Download metrics (Prometheus)", METRICS.prometheus_text(),
+                                   file_name="metrics.prom", mime="text/plain")
+
+        prompt_stats = validation_result.prompt_stats
+        if prompt_stats:
+            st.caption(
+                f"✂️ Prompt compaction saved ~{prompt_stats['tokens_saved']} tokens "
+                f"({prompt_stats['tokens_before']} → {prompt_stats['tokens_after']})"
+            )
 
         # Save results
         result_data = {
@@ -296,7 +413,8 @@ if uploaded_file:
             "check_group": check_group,
             "validation": validation_result,
         }
-        save_results(result_data)
+        record = {**result_data, "validation": validation_result.to_dict()}
+        RESULTS_STORE.save(record, file_hash=content_hash)
 
         # --------------------------
         # Display Report
@@ -309,7 +427,7 @@ if uploaded_file:
         with cols[0]:
             st.download_button(
                 label="💾 Download Results as JSON",
-                data=json.dumps(result_data, indent=4),
+                data=json.dumps(record, indent=4),
                 file_name=f"validation_{uploaded_file.name}.json",
                 mime="application/json",
                 use_container_width=True
@@ -318,17 +436,42 @@ if uploaded_file:
         with cols[1]:
             if st.button("🔍 Show Raw JSON", use_container_width=True):
                 with st.expander("Raw JSON Data", expanded=True):
-                    st.json(result_data)
+                    st.json(record)
 
 # --------------------------
 # Past Results Section
 # --------------------------
 st.markdown("<div class='section-title'>📜 Previous Validations</div>", unsafe_allow_html=True)
-if st.checkbox("Show Last Saved Results"):
-    past_results = load_results()
-    if past_results:
-        st.markdown("### Last Validation Report")
-        display_validation_report(past_results)
+HISTORY_PAGE_SIZE = 20
+if st.checkbox("Show Previous Validations"):
+    filter_cols = st.columns([2, 1, 1])
+    with filter_cols[0]:
+        history_file = st.text_input("File name", placeholder="All files").strip() or None
+    with filter_cols[1]:
+        history_group = st.selectbox("Group", ["Any", "Front", "Back", "All"])
+        history_group = None if history_group == "Any" else history_group
+    total_runs = RESULTS_STORE.count(file=history_file, check_group=history_group)
+    with filter_cols[2]:
+        history_page = st.number_input(
+            "Page", min_value=1, max_value=max(1, -(-total_runs // HISTORY_PAGE_SIZE)), value=1
+        )
+
+    # Only this page's summaries are read; the full report is loaded for
+    # the selected run alone.
+    runs = RESULTS_STORE.history(
+        page=history_page, page_size=HISTORY_PAGE_SIZE, file=history_file, check_group=history_group
+    )
+    if runs:
+        st.caption(f"{total_runs} saved validation(s)")
+        selected = st.selectbox(
+            "Validation",
+            runs,
+            format_func=lambda run: (
+                f"{datetime.fromtimestamp(run['created_at']):%Y-%m-%d %H:%M} · {run['file']} · "
+                f"{run['check_group']} · ✅ {run['passed']} ❌ {run['failed']}"
+            ),
+        )
+        display_validation_report(RESULTS_STORE.get(selected["id"]))
     else:
         st.warning("⚠️ No saved results found.")
 
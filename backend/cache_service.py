@@ -0,0 +1,169 @@
+# backend/cache_service.py
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def make_cache_key(*parts):
+    """
+    Build a SHA-256 cache key from bytes, strings or JSON-serializable parts.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        elif not isinstance(part, (bytes, bytearray, memoryview)):
+            part = json.dumps(part, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        digest.update(hashlib.sha256(part).digest())
+    return digest.hexdigest()
+
+
+# Besides when the tracked size goes over max_bytes, the directory is
+# rescanned at most this often: to expire old entries and to pick up
+# writes from other processes sharing it.
+EVICT_INTERVAL = 3600
+# Size eviction trims down to this fraction of max_bytes, so a full cache
+# is not rescanned on every write.
+EVICT_TARGET = 0.9
+
+
+class DiskCache:
+    """
+    Persistent JSON cache: one file per key under `directory`.
+    An entry's age is the time since it was written (its file mtime);
+    entries older than `max_age` seconds are treated as misses and removed.
+    When the directory grows past `max_bytes`, the least recently read
+    entries are evicted first (reads refresh the file's atime only, so
+    reading never extends an entry's life).
+    The directory size is tracked as entries are written, so set() scans
+    the directory only when the total passes max_bytes or EVICT_INTERVAL
+    has elapsed.
+    `hits` and `misses` count get() results for this process.
+    """
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, max_age=30 * 24 * 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._size = None  # bytes on disk as last scanned plus writes since
+        self._scanned_at = 0.0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def _expired(self, st, now):
+        return self.max_age is not None and now - st.st_mtime > self.max_age
+
+    def get(self, key):
+        """Return the cached value for `key`, or None on a miss."""
+        value = self._read(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def _read(self, key):
+        path = self._path(key)
+        try:
+            st = os.stat(path)
+            if self._expired(st, time.time()):
+                self._remove(path)
+                return None
+            with open(path, "r") as f:
+                entry = json.load(f)
+            # Mark the entry as recently used, keeping its write time.
+            os.utime(path, (time.time(), st.st_mtime))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return entry["value"]
+
+    def stats(self):
+        """Return hit/miss counters and the hit rate for this process."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def set(self, key, value):
+        """Store a JSON-serializable value under `key`."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        try:
+            replaced = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced = 0
+        # Write to a temp file and rename so concurrent readers never see a
+        # partial entry.
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"created": time.time(), "value": value}, f, separators=(",", ":"))
+        written = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._size is not None:
+                self._size += written - replaced
+            due = (
+                self._size is None
+                or time.time() - self._scanned_at > EVICT_INTERVAL
+                or (self.max_bytes is not None and self._size > self.max_bytes)
+            )
+        if due:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones beyond max_bytes."""
+        with self._lock:
+            entries = []
+            now = time.time()
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    if not name.endswith(".json"):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    if self._expired(st, now):
+                        self._remove(path)
+                        continue
+                    entries.append((max(st.st_atime, st.st_mtime), st.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            if self.max_bytes is not None and total > self.max_bytes:
+                target = self.max_bytes * EVICT_TARGET
+                for _, size, path in sorted(entries):
+                    self._remove(path)
+                    total -= size
+                    if total <= target:
+                        break
+            self._size = total
+            self._scanned_at = now
+
+    def clear(self):
+        """Remove every entry."""
+        with self._lock:
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    if name.endswith(".json"):
+                        self._remove(os.path.join(root, name))
+            self._size = 0
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -1,12 +1,159 @@
+import hashlib
 import json
 import os
+import sqlite3
+import threading
+import time
+from backend.validation_model import ValidationResult
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    file_hash TEXT,
+    file TEXT NOT NULL,
+    check_group TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    passed INTEGER NOT NULL,
+    failed INTEGER NOT NULL,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_by_hash ON results (file_hash, check_group, created_at);
+CREATE INDEX IF NOT EXISTS results_by_file ON results (file, check_group, created_at);
+CREATE INDEX IF NOT EXISTS results_by_time ON results (created_at);
+"""
+
+SUMMARY_COLUMNS = ("id", "file_hash", "file", "check_group", "created_at", "passed", "failed")
+
+
+def file_hash(data):
+    """SHA-256 of an artwork file's bytes (or of the file at a path)."""
+    if isinstance(data, str):
+        with open(data, "rb") as f:
+            data = f.read()
+    return hashlib.sha256(data).hexdigest()
+
+
+class ResultStore:
+    """
+    Append-only validation history in SQLite (WAL mode, so the app's
+    sessions and batch runs can write while others read).
+    Each row is one run, keyed by file hash, file name, check group and
+    time. History queries return summaries only; the full record is read
+    for the one run being displayed.
+    A legacy results.json next to a new store is imported once on creation.
+    """
+
+    def __init__(self, path, legacy_json="results.json"):
+        self.path = path
+        self.legacy_json = legacy_json
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        with self._init_lock:
+            if not self._initialized:
+                with conn:
+                    conn.executescript(SCHEMA)
+                self._initialized = True
+                if conn.execute("SELECT 1 FROM results LIMIT 1").fetchone() is None:
+                    self._import_legacy(conn)
+        return conn
+
+    def _import_legacy(self, conn):
+        if not self.legacy_json or not os.path.exists(self.legacy_json):
+            return
+        record = load_results(self.legacy_json)
+        if record is None:
+            return
+        self._insert(conn, record, None, os.path.getmtime(self.legacy_json))
+
+    def _insert(self, conn, record, file_hash, created_at):
+        validation = record["validation"]
+        if not isinstance(validation, ValidationResult):
+            validation = ValidationResult.from_dict(validation)
+        stored = {**record, "validation": validation.to_dict()}
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO results (file_hash, file, check_group, created_at, passed, failed, record) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (file_hash, record["file"], record["check_group"], created_at,
+                 len(validation.passed), len(validation.failed), json.dumps(stored)),
+            )
+        return cursor.lastrowid
+
+    def save(self, record, file_hash=None):
+        """
+        Append a run ({"file", "check_group", "validation", ...}; validation
+        as a ValidationResult or its dict). Returns the new row id.
+        """
+        return self._insert(self._connect(), record, file_hash, time.time())
+
+    @staticmethod
+    def _where(file, file_hash, check_group):
+        clauses, params = [], []
+        for column, value in (("file", file), ("file_hash", file_hash), ("check_group", check_group)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def history(self, page=1, page_size=20, file=None, file_hash=None, check_group=None):
+        """
+        One page (1-based) of run summaries, newest first, optionally for
+        one file name/hash and check group. Summaries hold SUMMARY_COLUMNS;
+        use get() for the full record.
+        """
+        where, params = self._where(file, file_hash, check_group)
+        rows = self._connect().execute(
+            f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM results{where} "
+            "ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?",
+            params + [page_size, (max(page, 1) - 1) * page_size],
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def count(self, file=None, file_hash=None, check_group=None):
+        """Number of runs matching the same filters as history()."""
+        where, params = self._where(file, file_hash, check_group)
+        return self._connect().execute(f"SELECT COUNT(*) FROM results{where}", params).fetchone()[0]
+
+    def get(self, result_id):
+        """Full record of one run with "validation" as a ValidationResult, or None."""
+        row = self._connect().execute("SELECT record FROM results WHERE id = ?", (result_id,)).fetchone()
+        if row is None:
+            return None
+        record = json.loads(row["record"])
+        record["validation"] = ValidationResult.from_dict(record["validation"])
+        return record
+
+    def latest(self, file=None, file_hash=None, check_group=None):
+        """Full record of the most recent matching run, or None."""
+        summaries = self.history(page=1, page_size=1, file=file, file_hash=file_hash, check_group=check_group)
+        return self.get(summaries[0]["id"]) if summaries else None
+
+
+RESULTS_STORE = ResultStore(os.getenv("RESULTS_DB", "results.db"))
+
 
 def save_results(data, filename="results.json"):
     with open(filename, "w") as f:
         json.dump(data, f, indent=2)
 
 def load_results(filename="results.json"):
+    """
+    Load the saved record with its "validation" as a ValidationResult.
+    Records saved before results were stored structured are parsed here.
+    """
     if os.path.exists(filename):
         with open(filename, "r") as f:
-            return json.load(f)
+            data = json.load(f)
+        data["validation"] = ValidationResult.from_dict(data["validation"])
+        return data
     return None
@@ -1,7 +1,297 @@
 # backend/image_detecter.py
 import cv2
+import hashlib
 import numpy as np
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from backend.metrics import increment, propagate, span
+
+TEMPLATE_EXTENSIONS = (".jpg", ".png")
+DEFAULT_SCALES = (0.5, 0.8, 1.0, 1.2, 1.5)
+DEFAULT_TEMPLATES_FOLDER = os.getenv("TEMPLATES_FOLDER", "D:/Bazooka/bazooka/symbols/")
+
+# Coarse-to-fine search: templates smaller than this on the coarse level are
+# matched at full resolution instead, and coarse hits are accepted this far
+# below the final threshold so refinement still sees borderline symbols.
+MIN_COARSE_TEMPLATE_SIZE = 8
+COARSE_THRESHOLD_MARGIN = 0.15
+
+# Upper bound on matching threads; cv2.matchTemplate releases the GIL.
+DEFAULT_MATCH_WORKERS = min(16, os.cpu_count() or 1)
+
+# Response-map peaks kept per (template, scale) before NMS.
+MAX_PEAKS_PER_MAP = 200
+
+
+class TemplateLibrary:
+    """
+    Grayscale symbol templates loaded once from a folder and pre-resized to
+    every matching scale.
+    Entries are re-read only when a file's mtime/size changes and its content
+    hash no longer matches; removed files are dropped on the next refresh.
+    """
+
+    def __init__(self, templates_folder, scales=DEFAULT_SCALES):
+        self.templates_folder = templates_folder
+        self.scales = tuple(scales)
+        self._entries = {}  # file name -> {"stat", "sha1", "template", "sizes": {scale: template}}
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Sync the library with the templates folder."""
+        names = sorted(
+            f for f in os.listdir(self.templates_folder) if f.lower().endswith(TEMPLATE_EXTENSIONS)
+        )
+        with self._lock:
+            for name in set(self._entries) - set(names):
+                del self._entries[name]
+
+            for name in names:
+                path = os.path.join(self.templates_folder, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    self._entries.pop(name, None)
+                    continue
+                stat_key = (st.st_mtime_ns, st.st_size)
+
+                entry = self._entries.get(name)
+                if entry is not None and entry["stat"] == stat_key:
+                    continue
+
+                with open(path, "rb") as f:
+                    data = f.read()
+                sha1 = hashlib.sha1(data).hexdigest()
+                if entry is not None and entry["sha1"] == sha1:
+                    # Touched but unchanged: keep the prepared scales.
+                    entry["stat"] = stat_key
+                    continue
+
+                template = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+                if template is None:
+                    self._entries.pop(name, None)
+                    continue
+
+                self._entries[name] = {
+                    "stat": stat_key,
+                    "sha1": sha1,
+                    "template": template,
+                    "sizes": {scale: self._resize(template, scale) for scale in self.scales},
+                    "pyramid": {},
+                }
+
+    @staticmethod
+    def _resize(template, scale):
+        h, w = template.shape[:2]
+        new_w = int(w * scale)
+        new_h = int(h * scale)
+        if new_w < 1 or new_h < 1:
+            return None
+        if (new_w, new_h) == (w, h):
+            return template
+        return cv2.resize(template, (new_w, new_h))
+
+    def templates(self, scales=None):
+        """
+        Return [(file name, scale, resized grayscale template)] ordered by file
+        name, then by scale order. Scales outside the prepared set are resized
+        once and kept for later calls.
+        """
+        scales = self.scales if scales is None else tuple(scales)
+        out = []
+        with self._lock:
+            for name in sorted(self._entries):
+                entry = self._entries[name]
+                for scale in scales:
+                    if scale not in entry["sizes"]:
+                        entry["sizes"][scale] = self._resize(entry["template"], scale)
+                    resized = entry["sizes"][scale]
+                    if resized is not None:
+                        out.append((name, scale, resized))
+        return out
+
+    def downsampled(self, name, scale, levels):
+        """
+        Return the scaled template for `name` reduced `levels` times with
+        cv2.pyrDown, matching how detection downsamples the page.
+        """
+        with self._lock:
+            entry = self._entries[name]
+            key = (scale, levels)
+            if key not in entry["pyramid"]:
+                small = entry["sizes"].get(scale)
+                for _ in range(levels):
+                    if small is None or min(small.shape[:2]) < 2:
+                        small = None
+                        break
+                    small = cv2.pyrDown(small)
+                entry["pyramid"][key] = small
+            return entry["pyramid"][key]
+
+
+_LIBRARIES = {}
+_LIBRARIES_LOCK = threading.Lock()
+
+
+def get_template_library(templates_folder):
+    """
+    Return the process-wide TemplateLibrary for a folder, refreshed against
+    the files on disk. Shared by every caller (and every Streamlit session).
+    """
+    key = os.path.abspath(templates_folder)
+    with _LIBRARIES_LOCK:
+        library = _LIBRARIES.get(key)
+        if library is None:
+            library = _LIBRARIES[key] = TemplateLibrary(templates_folder)
+    library.refresh()
+    return library
+
+
+_EMPTY_PEAKS = (np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32))
+
+
+def _extract_peaks(result, threshold, template_shape, max_peaks=MAX_PEAKS_PER_MAP):
+    """
+    Reduce a matchTemplate response map to its local maxima at or above
+    threshold (dilation over a window of half the template size), keeping the
+    best `max_peaks`. Returns (xs, ys, scores) arrays in raster order.
+    """
+    _, max_val, _, _ = cv2.minMaxLoc(result)
+    if max_val < threshold:
+        return _EMPTY_PEAKS
+
+    th, tw = template_shape[:2]
+    k = max(3, (min(th, tw) // 2) | 1)
+    dilated = cv2.dilate(result, cv2.getStructuringElement(cv2.MORPH_RECT, (k, k)))
+    ys, xs = np.nonzero((result >= threshold) & (result >= dilated))
+    scores = result[ys, xs]
+
+    if len(scores) > max_peaks:
+        top = np.sort(np.argpartition(-scores, max_peaks - 1)[:max_peaks])
+        xs, ys, scores = xs[top], ys[top], scores[top]
+    return xs, ys, scores
+
+
+def _match_full(gray, template, threshold):
+    """
+    Match a template over the whole image.
+    Returns (xs, ys, scores) arrays of response peaks at or above threshold.
+    """
+    result = cv2.matchTemplate(gray, template, cv2.TM_CCOEFF_NORMED)
+    return _extract_peaks(result, threshold, template.shape)
+
+
+def _coarse_candidates(result, template_shape, threshold, max_candidates):
+    """
+    Pick up to `max_candidates` peaks from a coarse response map, best first,
+    blanking a template-sized neighbourhood around each pick.
+    """
+    result = result.copy()
+    th, tw = template_shape[:2]
+    candidates = []
+    for _ in range(max_candidates):
+        _, max_val, _, (x, y) = cv2.minMaxLoc(result)
+        if max_val < threshold:
+            break
+        candidates.append((x, y))
+        result[max(0, y - th // 2):y + th // 2 + 1, max(0, x - tw // 2):x + tw // 2 + 1] = -1
+    return candidates
+
+
+def _match_pyramid(gray, coarse_gray, template, coarse_template, factor, threshold, max_candidates):
+    """
+    Coarse-to-fine match: find candidate regions on the downsampled page,
+    then re-run the match at full resolution only inside those ROIs.
+    Returns (xs, ys, scores) arrays in full-resolution coordinates.
+    """
+    coarse_result = cv2.matchTemplate(coarse_gray, coarse_template, cv2.TM_CCOEFF_NORMED)
+    candidates = _coarse_candidates(
+        coarse_result, coarse_template.shape, threshold - COARSE_THRESHOLD_MARGIN, max_candidates
+    )
+    h, w = template.shape[:2]
+    pad = 2 * factor
+    rois = [(cx * factor - pad, cy * factor - pad, w + 2 * pad, h + 2 * pad) for cx, cy in candidates]
+    return _match_rois(gray, template, threshold, rois)
+
+
+def _match_rois(gray, template, threshold, rois):
+    """
+    Match a template inside (x, y, w, h) regions of the image only.
+    Returns (xs, ys, scores) arrays in full-image coordinates.
+    """
+    H, W = gray.shape[:2]
+    h, w = template.shape[:2]
+    matches = {}
+    for x, y, rw, rh in rois:
+        x0 = max(0, x)
+        y0 = max(0, y)
+        x1 = min(W, x + rw)
+        y1 = min(H, y + rh)
+        if x1 - x0 < w or y1 - y0 < h:
+            continue
+        xs, ys, scores = _match_full(gray[y0:y1, x0:x1], template, threshold)
+        for x, y, conf in zip(xs, ys, scores):
+            # Overlapping ROIs can revisit the same pixel; keep one entry.
+            matches[(int(x) + x0, int(y) + y0)] = conf
+
+    if not matches:
+        return _EMPTY_PEAKS
+    points = sorted(matches, key=lambda p: (p[1], p[0]))
+    xs = np.array([p[0] for p in points])
+    ys = np.array([p[1] for p in points])
+    scores = np.array([matches[p] for p in points], np.float32)
+    return xs, ys, scores
+
+
+def _nms_indices(boxes, scores, overlap_thresh):
+    """
+    Greedy NMS over an (n, 4) array of x1, y1, x2, y2 boxes.
+    Boxes are bucketed on a grid as large as the biggest box, so each kept
+    box is only compared against boxes in its own and adjacent cells.
+    Ties in score keep input order. Returns kept indices, best first.
+    """
+    n = len(boxes)
+    if n == 0:
+        return np.empty(0, np.int64)
+
+    boxes = boxes.astype(np.float64)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = np.lexsort((np.arange(n), -np.asarray(scores)))
+
+    cell = max(1.0, float(np.max(boxes[:, 2:] - boxes[:, :2])))
+    cx = (boxes[:, 0] // cell).astype(np.int64)
+    cy = (boxes[:, 1] // cell).astype(np.int64)
+    buckets = {}
+    for i, key in enumerate(zip(cx.tolist(), cy.tolist())):
+        buckets.setdefault(key, []).append(i)
+    buckets = {key: np.array(idx) for key, idx in buckets.items()}
+
+    suppressed = np.zeros(n, dtype=bool)
+    keep = []
+    for i in order:
+        if suppressed[i]:
+            continue
+        keep.append(i)
+
+        near = [
+            buckets[key]
+            for key in ((cx[i] + dx, cy[i] + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1))
+            if key in buckets
+        ]
+        near = np.concatenate(near)
+        near = near[~suppressed[near]]
+
+        w = np.maximum(0, np.minimum(boxes[i, 2], boxes[near, 2]) - np.maximum(boxes[i, 0], boxes[near, 0]))
+        h = np.maximum(0, np.minimum(boxes[i, 3], boxes[near, 3]) - np.maximum(boxes[i, 1], boxes[near, 1]))
+        inter = w * h
+        iou = inter / (areas[i] + areas[near] - inter + 1e-6)
+
+        suppressed[near[iou >= overlap_thresh]] = True
+        suppressed[i] = True
+
+    return np.array(keep, dtype=np.int64)
+
 
 def non_max_suppression(detections, overlap_thresh=0.3):
     """
@@ -16,40 +306,36 @@ def non_max_suppression(detections, overlap_thresh=0.3):
         for d in detections
     ])
     confidences = np.array([d["confidence"] for d in detections])
-    idxs = np.argsort(confidences)[::-1]  # high → low
-
-    keep = []
-    while len(idxs) > 0:
-        i = idxs[0]
-        keep.append(i)
-
-        # Compute IoU with remaining boxes
-        xx1 = np.maximum(boxes[i, 0], boxes[idxs[1:], 0])
-        yy1 = np.maximum(boxes[i, 1], boxes[idxs[1:], 1])
-        xx2 = np.minimum(boxes[i, 2], boxes[idxs[1:], 2])
-        yy2 = np.minimum(boxes[i, 3], boxes[idxs[1:], 3])
-
-        w = np.maximum(0, xx2 - xx1)
-        h = np.maximum(0, yy2 - yy1)
-        inter = w * h
-
-        area_i = (boxes[i, 2] - boxes[i, 0]) * (boxes[i, 3] - boxes[i, 1])
-        area_rest = (boxes[idxs[1:], 2] - boxes[idxs[1:], 0]) * (boxes[idxs[1:], 3] - boxes[idxs[1:], 1])
-
-        iou = inter / (area_i + area_rest - inter + 1e-6)
 
-        idxs = idxs[1:][iou < overlap_thresh]
+    return [detections[i] for i in _nms_indices(boxes, confidences, overlap_thresh)]
 
-    return [detections[i] for i in keep]
 
-
-def detect_kosher_symbol(image_path, templates_folder="D:/Bazooka/bazooka/symbols/", threshold=0.75, scales=None, visualize=True):
+def detect_kosher_symbol(image_path, templates_folder=DEFAULT_TEMPLATES_FOLDER, threshold=0.75, scales=None, visualize=True,
+                         mode="full", pyramid_levels=1, pyramid_candidates=20, workers=None, regions=None,
+                         stats=None):
     """
     Detects Kosher symbols in an image using multi-scale template matching.
+    Templates come from the shared TemplateLibrary, so only the matching
+    work is done per call.
+    mode="pyramid" matches on a page reduced `pyramid_levels` times first and
+    refines only the best `pyramid_candidates` regions per template/scale at
+    full resolution; raise either knob for recall, lower them for speed.
+    Each (template, scale) pair is matched on a pool of `workers` threads
+    (default DEFAULT_MATCH_WORKERS, 1 runs serially); candidates are merged
+    in job order, so the result does not depend on thread scheduling.
+    `regions`, a list of (x, y, w, h) rectangles, limits matching to those
+    parts of the page (each grown by the template size so symbols crossing
+    an edge are still found); used to re-check only what changed.
+    Pass a dict as `stats` to get the work done per stage: "jobs"
+    (template/scale pairs matched), "candidates" (peaks entering NMS) and
+    "detections" (kept after NMS).
     Applies Non-Maximum Suppression (NMS) to avoid duplicate detections.
     Returns a list of detected symbols.
     Optionally saves visualization with bounding boxes.
     """
+    if mode not in ("full", "pyramid"):
+        raise ValueError(f"Unknown detection mode: {mode}")
+
     img = cv2.imread(image_path)
     if img is None:
         raise ValueError(f"Image not found: {image_path}")
@@ -58,43 +344,96 @@ def detect_kosher_symbol(image_path, templates_folder="D:/Bazooka/bazooka/symbol
     H, W = gray.shape[:2]
 
     if scales is None:
-        scales = [0.5, 0.8, 1.0, 1.2, 1.5]
+        scales = DEFAULT_SCALES
+    if workers is None:
+        workers = DEFAULT_MATCH_WORKERS
 
-    template_files = [f for f in os.listdir(templates_folder) if f.lower().endswith((".jpg", ".png"))]
-    found_symbols = []
+    coarse_gray = None
+    if mode == "pyramid" and pyramid_levels > 0:
+        coarse_gray = gray
+        for _ in range(pyramid_levels):
+            coarse_gray = cv2.pyrDown(coarse_gray)
+    factor = 2 ** pyramid_levels
 
-    for template_file in template_files:
-        template_path = os.path.join(templates_folder, template_file)
-        template = cv2.imread(template_path, cv2.IMREAD_GRAYSCALE)
-        if template is None:
+    with span("detect.templates"):
+        library = get_template_library(templates_folder)
+    jobs = []
+    for template_file, scale, resized_template in library.templates(scales):
+        new_h, new_w = resized_template.shape[:2]
+
+        if new_w < 10 or new_h < 10 or new_w > W or new_h > H:
             continue
 
-        h, w = template.shape[:2]
+        coarse_template = None
+        if coarse_gray is not None:
+            coarse_template = library.downsampled(template_file, scale, pyramid_levels)
+            if coarse_template is not None and min(coarse_template.shape[:2]) < MIN_COARSE_TEMPLATE_SIZE:
+                coarse_template = None
+        jobs.append((template_file, scale, resized_template, coarse_template))
 
-        for scale in scales:
-            new_w = int(w * scale)
-            new_h = int(h * scale)
+    def match_job(job):
+        _, _, resized_template, coarse_template = job
+        if regions is not None:
+            h, w = resized_template.shape[:2]
+            rois = [(x - w, y - h, rw + 2 * w, rh + 2 * h) for x, y, rw, rh in regions]
+            return _match_rois(gray, resized_template, threshold, rois)
+        if coarse_template is not None:
+            return _match_pyramid(
+                gray, coarse_gray, resized_template, coarse_template, factor, threshold, pyramid_candidates
+            )
+        return _match_full(gray, resized_template, threshold)
 
-            if new_w < 10 or new_h < 10 or new_w > W or new_h > H:
-                continue
+    def run_job(job):
+        with span("detect.match", template=job[0], scale=job[1]):
+            return match_job(job)
+
+    with span("detect.match_all", jobs=len(jobs), mode=mode):
+        if workers > 1 and len(jobs) > 1:
+            with ThreadPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+                # map() yields in submission order, whatever finishes first.
+                job_matches = list(executor.map(propagate(run_job), jobs))
+        else:
+            job_matches = [run_job(job) for job in jobs]
+
+    # Merge every job's peaks into flat arrays; dicts are built only for
+    # the detections that survive NMS.
+    boxes, scores, job_ids = [], [], []
+    for job_id, ((_, _, resized_template, _), (xs, ys, confs)) in enumerate(zip(jobs, job_matches)):
+        new_h, new_w = resized_template.shape[:2]
+        boxes.append(np.stack([xs, ys, xs + new_w, ys + new_h], axis=1).reshape(-1, 4))
+        scores.append(confs)
+        job_ids.append(np.full(len(confs), job_id))
 
-            resized_template = cv2.resize(template, (new_w, new_h))
+    candidates = int(sum(len(s) for s in scores))
+    increment("detect_jobs", len(jobs))
+    increment("detect_candidates", candidates)
+    if stats is not None:
+        stats["jobs"] = len(jobs)
+        stats["candidates"] = candidates
 
-            result = cv2.matchTemplate(gray, resized_template, cv2.TM_CCOEFF_NORMED)
-            locations = np.where(result >= threshold)
+    final_detections = []
+    if boxes:
+        boxes = np.concatenate(boxes)
+        scores = np.concatenate(scores)
+        job_ids = np.concatenate(job_ids)
 
-            for pt in zip(*locations[::-1]):
-                conf = float(result[pt[1], pt[0]])
-                found_symbols.append({
-                    "symbol": template_file,
-                    "confidence": conf,
-                    "location": pt,
-                    "scale": scale,
-                    "size": (new_w, new_h)
-                })
+        # Apply Non-Maximum Suppression
+        with span("detect.nms", candidates=candidates):
+            keep = _nms_indices(boxes, scores, overlap_thresh=0.3)
+        for i in keep:
+            template_file, scale, resized_template, _ = jobs[job_ids[i]]
+            new_h, new_w = resized_template.shape[:2]
+            final_detections.append({
+                "symbol": template_file,
+                "confidence": float(scores[i]),
+                "location": (int(boxes[i, 0]), int(boxes[i, 1])),
+                "scale": scale,
+                "size": (new_w, new_h)
+            })
 
-    # Apply Non-Maximum Suppression
-    final_detections = non_max_suppression(found_symbols, overlap_thresh=0.3)
+    increment("detect_detections", len(final_detections))
+    if stats is not None:
+        stats["detections"] = len(final_detections)
 
     # Draw bounding boxes for visualization
     if visualize and final_detections:
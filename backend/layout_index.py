@@ -0,0 +1,121 @@
+# backend/layout_index.py
+import bisect
+import json
+import re
+from collections import namedtuple
+from backend.textract_store import STORE_SUFFIX, load_textract
+
+# Geometry is Textract's normalized page coordinates (0..1, origin top-left).
+Line = namedtuple("Line", ["text", "page", "left", "top", "width", "height"])
+
+
+def _bottom(line):
+    return line.top + line.height
+
+
+class LineIndex:
+    """
+    Spatial index over Textract LINE blocks.
+    Lines are kept per page sorted by top edge, so vertical band and
+    above/below queries are a bisect plus a slice. Band fractions are taken
+    over the page's text extent (first line top to last line bottom), which
+    ignores blank margins around the artwork.
+    """
+
+    def __init__(self, lines):
+        self._pages = {}
+        for line in sorted(lines, key=lambda l: (l.page, l.top, l.left)):
+            self._pages.setdefault(line.page, []).append(line)
+        self._tops = {page: [l.top for l in lines] for page, lines in self._pages.items()}
+        self._extent = {
+            page: (lines[0].top, max(_bottom(l) for l in lines)) for page, lines in self._pages.items()
+        }
+
+    @classmethod
+    def from_blocks(cls, blocks, page=1):
+        """Build an index from a Textract "Blocks" list for one page."""
+        lines = []
+        for block in blocks:
+            if block.get("BlockType") != "LINE":
+                continue
+            box = block.get("Geometry", {}).get("BoundingBox")
+            if not box:
+                continue
+            lines.append(Line(block["Text"], page,
+                              box["Left"], box["Top"], box["Width"], box["Height"]))
+        return cls(lines)
+
+    @classmethod
+    def from_pages(cls, ocr_pages):
+        """Build one index from extract_text_pages() output."""
+        lines = []
+        for ocr_page in ocr_pages:
+            lines.extend(cls.from_blocks(ocr_page["blocks"], page=ocr_page["page"]).lines())
+        return cls(lines)
+
+    @property
+    def pages(self):
+        return sorted(self._pages)
+
+    def lines(self, page=None):
+        """All lines, top to bottom (page by page when `page` is None)."""
+        if page is not None:
+            return list(self._pages.get(page, []))
+        return [line for p in self.pages for line in self._pages[p]]
+
+    def in_band(self, start, end, page=None):
+        """
+        Lines whose top edge falls within [start, end], as fractions of the
+        page's text extent.
+        """
+        out = []
+        for p in ([page] if page is not None else self.pages):
+            if p not in self._pages:
+                continue
+            first, last = self._extent[p]
+            span = last - first
+            lo = bisect.bisect_left(self._tops[p], first + start * span)
+            hi = bisect.bisect_right(self._tops[p], first + end * span)
+            out.extend(self._pages[p][lo:hi])
+        return out
+
+    def bottom(self, fraction=0.2, page=None):
+        """Lines in the bottom `fraction` of each page's text extent."""
+        return self.in_band(1.0 - fraction, 1.0, page)
+
+    def top(self, fraction=0.2, page=None):
+        """Lines in the top `fraction` of each page's text extent."""
+        return self.in_band(0.0, fraction, page)
+
+    def find(self, pattern, page=None):
+        """Lines whose text matches a regex (string or compiled), top to bottom."""
+        if isinstance(pattern, str):
+            pattern = re.compile(pattern, re.IGNORECASE)
+        return [line for line in self.lines(page) if pattern.search(line.text)]
+
+    def below(self, line):
+        """Lines on the same page that start at or under `line`'s bottom edge."""
+        lines = self._pages.get(line.page, [])
+        lo = bisect.bisect_left(self._tops[line.page], _bottom(line)) if lines else 0
+        return lines[lo:]
+
+    def above(self, line):
+        """Lines on the same page that end at or over `line`'s top edge."""
+        return [l for l in self._pages.get(line.page, []) if _bottom(l) <= line.top]
+
+    def is_below(self, line, other):
+        """True when `line` sits under `other` on the same page."""
+        return line.page == other.page and line.top >= _bottom(other) - other.height / 2
+
+
+def load_layout_index(path, page=1):
+    """
+    Build a LineIndex from a stored Textract response: the compact store
+    (only LINE text and geometry are read) or a raw JSON dump.
+    """
+    if path.endswith(STORE_SUFFIX):
+        with load_textract(path) as stored:
+            return LineIndex(stored.lines(page=page))
+    with open(path, "r") as f:
+        response = json.load(f)
+    return LineIndex.from_blocks(response["Blocks"], page=page)
@@ -1,7 +1,24 @@
 # backend/llm_service.py
 import os
+import queue
+import re
+import threading
+import time
 from dotenv import load_dotenv
 import google.generativeai as genai
+from backend.cache_service import DiskCache, make_cache_key
+from backend.metrics import increment, propagate, span
+from backend.prompt_compaction import compact_ocr_text, estimate_tokens
+from backend.service_backends import backend_name, cache_key_parts, make_model
+from backend.rule_engine import evaluate_rules
+from backend.validation_model import (
+    RESPONSE_SCHEMA,
+    Check,
+    CheckStreamParser,
+    SpellingIssue,
+    ValidationResult,
+    parse_model_json,
+)
 
 # Load API keys from .env
 load_dotenv()
@@ -9,6 +26,32 @@ load_dotenv()
 # Configure Gemini
 genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 
+MODEL_NAME = "gemini-2.5-flash"
+
+# Schema-constrained JSON output: the reply is always a bare JSON object
+# matching RESPONSE_SCHEMA.
+GENERATION_CONFIG = genai.GenerationConfig(
+    response_mime_type="application/json",
+    response_schema=RESPONSE_SCHEMA,
+)
+
+# "All" validations send each rule group as its own parallel request.
+# A shard that has not answered within LLM_SHARD_TIMEOUT seconds is reported
+# as unanswered instead of holding up the rest of the report.
+LLM_SHARD_TIMEOUT = float(os.getenv("LLM_SHARD_TIMEOUT", 60))
+
+_MODELS = {}
+_MODELS_LOCK = threading.Lock()
+
+# Validation responses keyed by normalized OCR text, the rules sent, the
+# prompt and the model. Editing a rule changes the key of every result that
+# used it, so stale results are never served; they age out via TTL/LRU.
+LLM_CACHE = DiskCache(
+    os.getenv("LLM_CACHE_DIR", ".cache/llm"),
+    max_bytes=int(os.getenv("LLM_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+    max_age=int(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600)),
+)
+
 # Define checks
 VALIDATION_CHECKS = {
     "Front": [
@@ -29,30 +72,13 @@ VALIDATION_CHECKS = {
 }
 
 
-def validate_text_with_llm(ocr_text: str, selected_group: str = "All"):
-    """
-    Validate OCR text using Gemini LLM against predefined checks.
-    selected_group can be "Front", "Back", "Canada", or "All"
-    """
-
-    # Collect relevant checks
-    checks_to_run = []
-    if selected_group == "All":
-        for group_checks in VALIDATION_CHECKS.values():
-            checks_to_run.extend(group_checks)
-    elif selected_group in ["Front", "Back", "Canada"]:
-        checks_to_run = VALIDATION_CHECKS.get(selected_group, [])
-    else:
-        return {"error": f"Unknown group: {selected_group}"}
-
-    # Build prompt
-    prompt = f"""
+PROMPT_TEMPLATE = """
 You are a compliance validator for candy packaging labels. 
 You will receive OCR extracted text only from an image of a Bazooka candy package. 
 Check the text against the following rules:
 
 Rules to check:
-{chr(10).join(f"- {c}" for c in checks_to_run)}
+{rules}
 
 OCR text:
 \"\"\"
@@ -63,7 +89,6 @@ Return a JSON object with each rule, validation result (PASS/FAIL), and reasonin
 Additionally, check the OCR text for typos **only in the actual packaging text **
 - Ignore proofing or print-related text such as: "PROOF #", "REEZE", "TABLE", "DIELINE", "COLOR", crop marks, or any other non-packaging annotations. 
 - If no spelling issues are found, return an empty list.
-- If the OCR text contains 'Gelatin' or 'Gelatine' (case-insensitive, and allow for minor OCR spelling variations like 'Gelatan', 'Gelatln', etc.) in the ingredients list, AND the packaging also shows any Kosher symbol (e.g., 'U', 'OU', 'Kosher', 'K'), then this must be marked as FAIL.
 
 
 Format the JSON response exactly like this:
@@ -87,8 +112,329 @@ Format the JSON response exactly like this:
 }}
 """
 
-    # Run Gemini Flash 2.5
-    model = genai.GenerativeModel("gemini-2.5-flash")
-    response = model.generate_content(prompt)
 
-    return response.text
+def normalize_ocr_text(ocr_text: str) -> str:
+    """
+    Normalize OCR text for cache keys: collapse runs of spaces/tabs, strip
+    each line and drop blank lines, so whitespace-only differences still hit.
+    """
+    lines = (re.sub(r"[ \t]+", " ", line).strip() for line in ocr_text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def get_model(model_name: str = MODEL_NAME):
+    """
+    Return the process-wide GenerativeModel for `model_name`, configured for
+    schema-constrained JSON. Built once and shared by every request.
+    The backend selected in the environment (see service_backends) may
+    record its replies or replace it with a replay of recorded ones.
+    """
+    key = (backend_name("gemini"), model_name)
+    with _MODELS_LOCK:
+        model = _MODELS.get(key)
+        if model is None:
+            model = _MODELS[key] = make_model(
+                lambda: genai.GenerativeModel(model_name, generation_config=GENERATION_CONFIG), model_name
+            )
+    return model
+
+
+def group_rules(selected_group):
+    """Rules checked for a group, in report order. Raises ValueError for an unknown group."""
+    # Collect relevant checks
+    checks_to_run = []
+    if selected_group == "All":
+        for group_checks in VALIDATION_CHECKS.values():
+            checks_to_run.extend(group_checks)
+    elif selected_group in ["Front", "Back", "Canada"]:
+        checks_to_run = VALIDATION_CHECKS.get(selected_group, [])
+    else:
+        raise ValueError(f"Unknown group: {selected_group}")
+    return checks_to_run
+
+
+def _plan_validation(ocr_text, selected_group, symbols, local_rules, layout, compact, concurrent, shard_size,
+                     prior_checks=None, notes=()):
+    """
+    Resolve the rule set, run the local rule engine, take `prior_checks`
+    answers for rules still open, and split the rules left for the model
+    into shards, each with its own prompt and cache key. `notes` are lines
+    appended to the OCR text in the prompt, kept whatever the budget.
+    Without `concurrent` (or for a single group) there is one shard; for
+    "All" there is one shard per rule group, or chunks of `shard_size` rules.
+    Raises ValueError for an unknown group.
+    """
+    checks_to_run = group_rules(selected_group)
+
+    resolved, unresolved = {}, list(checks_to_run)
+    if local_rules:
+        resolved, unresolved = evaluate_rules(checks_to_run, ocr_text, symbols, layout)
+    unresolved = list(dict.fromkeys(unresolved))
+    if prior_checks:
+        for rule in [rule for rule in unresolved if rule in prior_checks]:
+            resolved[rule] = prior_checks[rule].to_dict()
+            unresolved.remove(rule)
+
+    prompt_text, prompt_stats, warnings = "\n".join([ocr_text, *notes]), {}, []
+    if compact:
+        prompt_text, prompt_stats = compact_ocr_text(ocr_text, notes=notes)
+        if prompt_stats["truncated_lines"]:
+            warnings.append(
+                f"The OCR text exceeded the prompt budget: its last {prompt_stats['truncated_lines']} line(s) "
+                "were not sent to the model. Check bottom-of-panel copy by hand."
+            )
+
+    if concurrent and shard_size:
+        rule_shards = [unresolved[i:i + shard_size] for i in range(0, len(unresolved), shard_size)]
+    elif concurrent and selected_group == "All":
+        rule_shards, seen = [], set()
+        for group_checks in VALIDATION_CHECKS.values():
+            shard = [rule for rule in dict.fromkeys(group_checks) if rule in unresolved and rule not in seen]
+            seen.update(shard)
+            if shard:
+                rule_shards.append(shard)
+    else:
+        rule_shards = [unresolved]
+    # Spelling is checked on every request, so even with every rule resolved
+    # locally there is one (rule-less) shard.
+    rule_shards = rule_shards or [[]]
+
+    increment("rules_resolved_locally", len(resolved))
+    increment("rules_sent_to_model", len(unresolved))
+    if prompt_stats:
+        increment("prompt_tokens_saved", prompt_stats["tokens_saved"])
+
+    normalized_text = normalize_ocr_text(prompt_text)
+    shards = []
+    for rules in rule_shards:
+        # Build prompt
+        prompt = PROMPT_TEMPLATE.format(
+            rules="\n".join(f"- {c}" for c in rules) or "- (none: only check spelling)",
+            ocr_text=prompt_text,
+        )
+        cache_key = make_cache_key(
+            normalized_text, rules, PROMPT_TEMPLATE, RESPONSE_SCHEMA, MODEL_NAME, *cache_key_parts("gemini")
+        )
+        shards.append({"rules": rules, "prompt": prompt, "cache_key": cache_key})
+
+    return {
+        "checks_to_run": checks_to_run,
+        "resolved": resolved,
+        "shards": shards,
+        "prompt_stats": prompt_stats,
+        "warnings": warnings,
+    }
+
+
+def _run_shard(index, shard, stream, timeout, events):
+    """
+    Worker body: ask the model about one shard and report on `events` as
+    ("check", index, check dict) while streaming, then ("done", index,
+    llm_data, error).
+    """
+    try:
+        model = get_model()
+        request_options = {"timeout": timeout}
+        with span("llm.request", shard=index, rules=len(shard["rules"]), stream=stream):
+            if stream:
+                parser = CheckStreamParser()
+                for chunk in model.generate_content(shard["prompt"], stream=True, request_options=request_options):
+                    for check in parser.feed(chunk.text):
+                        events.put(("check", index, check))
+                text = parser.text
+            else:
+                text = model.generate_content(shard["prompt"], request_options=request_options).text
+        events.put(("done", index, parse_model_json(text), None))
+    except Exception as e:
+        increment("llm_errors")
+        events.put(("done", index, {}, str(e)))
+
+
+def _iter_validation(plan, use_cache, stream, timeout):
+    """
+    Answer every shard of a plan, cached ones first and the rest on parallel
+    worker threads. Yields ("check", Check) for each model check as it is
+    known and finally ("result", ValidationResult). Shards still running at
+    the deadline are reported as unanswered; their threads are abandoned.
+    """
+    shards = plan["shards"]
+    replies = [None] * len(shards)
+    errors = []
+
+    for index, shard in enumerate(shards):
+        cached = LLM_CACHE.get(shard["cache_key"]) if use_cache else None
+        if use_cache:
+            increment("llm_cache_hits" if cached is not None else "llm_cache_misses")
+        if cached is not None:
+            replies[index] = cached
+            for check in cached.get("checks", []):
+                yield "check", Check.from_dict(check)
+
+    events = queue.Queue()
+    pending = {index for index, reply in enumerate(replies) if reply is None}
+    for index in sorted(pending):
+        increment("llm_requests")
+        increment("prompt_tokens", estimate_tokens(shards[index]["prompt"]))
+        threading.Thread(
+            target=propagate(_run_shard), args=(index, shards[index], stream, timeout, events), daemon=True
+        ).start()
+
+    deadline = time.monotonic() + timeout
+    while pending:
+        remaining = deadline - time.monotonic()
+        try:
+            event = events.get(timeout=max(0.0, remaining))
+        except queue.Empty:
+            increment("llm_timeouts", len(pending))
+            errors.append(f"{len(pending)} of {len(shards)} model request(s) timed out after {timeout:g}s")
+            break
+        if event[0] == "check":
+            yield "check", Check.from_dict(event[2])
+            continue
+
+        _, index, llm_data, error = event
+        pending.discard(index)
+        replies[index] = llm_data
+        if error:
+            errors.append(error)
+        elif use_cache:
+            LLM_CACHE.set(shards[index]["cache_key"], llm_data)
+
+    yield "result", merge_checks(plan, replies, "; ".join(errors) or None)
+
+
+def validate_text_with_llm(ocr_text: str, selected_group: str = "All", use_cache: bool = True,
+                           symbols=None, local_rules: bool = True, layout=None, compact: bool = True,
+                           concurrent: bool = True, shard_size=None, timeout: float = LLM_SHARD_TIMEOUT,
+                           prior_checks=None, notes=()):
+    """
+    Validate OCR text using Gemini LLM against predefined checks.
+    selected_group can be "Front", "Back", "Canada", or "All"
+    Rules the local rule engine can decide exactly (using `symbols`, the
+    detect_kosher_symbol output, and `layout`, a LineIndex over the OCR
+    lines) are answered without the model; only the rest are sent to Gemini.
+    With `compact`, the OCR text in the prompt is stripped of proof
+    annotations and duplicate lines and held to the token budget; cut lines
+    are reported in the result's warnings. `notes` are lines added after
+    the OCR text (e.g. a detected Kosher symbol) that are never cut.
+    With `concurrent`, "All" sends each rule group (or `shard_size` rules) as
+    a parallel request; a request slower than `timeout` seconds leaves its
+    rules unanswered and sets the result's error, keeping the rest.
+    `prior_checks` ({rule: Check}) are earlier answers known to still hold
+    (see version_diff); those rules are not sent to the model.
+    Returns a ValidationResult with checks in rule order, parsed once from
+    the model's schema-constrained JSON.
+    Responses are served from LLM_CACHE when the same text, rules, prompt
+    and model were validated before (replayed replies only to replay runs).
+    """
+    try:
+        with span("llm.plan"):
+            plan = _plan_validation(
+                ocr_text, selected_group, symbols, local_rules, layout, compact, concurrent, shard_size, prior_checks,
+                notes,
+            )
+    except ValueError as e:
+        return ValidationResult(error=str(e))
+
+    for kind, item in _iter_validation(plan, use_cache, stream=False, timeout=timeout):
+        if kind == "result":
+            return item
+
+
+def stream_validation(ocr_text: str, selected_group: str = "All", use_cache: bool = True,
+                      symbols=None, local_rules: bool = True, layout=None, compact: bool = True,
+                      concurrent: bool = True, shard_size=None, timeout: float = LLM_SHARD_TIMEOUT,
+                      prior_checks=None, notes=()):
+    """
+    Streaming variant of validate_text_with_llm, for progressive rendering.
+    Yields ("check", Check) events as results become known: locally
+    resolved checks first, then each model check as soon as its JSON object
+    closes in the token stream. Ends with one ("result", ValidationResult)
+    event holding the full report in rule order.
+    """
+    try:
+        with span("llm.plan"):
+            plan = _plan_validation(
+                ocr_text, selected_group, symbols, local_rules, layout, compact, concurrent, shard_size, prior_checks,
+                notes,
+            )
+    except ValueError as e:
+        yield "result", ValidationResult(error=str(e))
+        return
+
+    for rule in dict.fromkeys(plan["checks_to_run"]):
+        if rule in plan["resolved"]:
+            yield "check", Check.from_dict(plan["resolved"][rule])
+
+    yield from _iter_validation(plan, use_cache, stream=True, timeout=timeout)
+
+
+def _rule_key(rule):
+    return re.sub(r"[^a-z0-9+]", "", rule.lower())
+
+
+def match_checks(rules, llm_checks, by_position=True):
+    """
+    Pair the model's checks with the rules they answer: by the echoed rule
+    text first (exactly, then ignoring case and punctuation), then, with
+    `by_position`, by position among what is left. Matched checks are
+    rebuilt with the requested rule text.
+    Returns ({rule: Check}, unmatched checks).
+    """
+    rules = list(dict.fromkeys(rules))
+    answered = {}
+    remaining = list(llm_checks)
+    for match in (lambda rule, check: check.rule == rule,
+                  lambda rule, check: _rule_key(check.rule) == _rule_key(rule)):
+        for rule in rules:
+            if rule in answered:
+                continue
+            check = next((c for c in remaining if match(rule, c)), None)
+            if check is not None:
+                answered[rule] = Check(rule, check.result, check.reason)
+                remaining.remove(check)
+    open_rules = [rule for rule in rules if rule not in answered] if by_position else []
+    for rule, check in zip(open_rules, remaining):
+        answered[rule] = Check(rule, check.result, check.reason)
+    return answered, remaining[len(open_rules):]
+
+
+def merge_checks(plan, replies, error=None):
+    """
+    Combine locally resolved checks with the model's reply for each shard
+    into one ValidationResult in rule order. A shard's checks are matched to
+    its rules with match_checks(); rules without an answer, and every rule
+    of a shard that timed out (reply None), are reported as FAIL so a person
+    looks at them.
+    Unmatched model checks are kept as extra rows, except answers to rules
+    of this validation (already decided locally, by prior_checks or by
+    another shard), which would contradict the report.
+    Spelling issues are merged across shards without duplicates.
+    """
+    known_rules = {_rule_key(rule) for rule in plan["checks_to_run"]}
+    answered = {rule: Check.from_dict(check) for rule, check in plan["resolved"].items()}
+    extras = []
+    issues = {}
+    for shard, llm_data in zip(plan["shards"], replies):
+        if llm_data is None:
+            for rule in shard["rules"]:
+                answered[rule] = Check(rule, "FAIL", "The model request for this rule timed out; re-run validation.")
+            continue
+        matched, unmatched = match_checks(shard["rules"], [Check.from_dict(c) for c in llm_data.get("checks", [])])
+        answered.update(matched)
+        extras.extend(check for check in unmatched if _rule_key(check.rule) not in known_rules)
+        for issue in llm_data.get("spelling_grammar", {}).get("issues", []):
+            issue = SpellingIssue.from_dict(issue)
+            issues.setdefault((issue.ocr_text, issue.correct_text), issue)
+
+    checks = [
+        answered.get(rule) or Check(rule, "FAIL", "The model returned no result for this rule.")
+        for rule in plan["checks_to_run"]
+    ]
+    return ValidationResult(
+        checks=checks + extras,
+        issues=list(issues.values()),
+        prompt_stats=plan["prompt_stats"],
+        error=error,
+        warnings=plan["warnings"],
+    )
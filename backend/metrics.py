@@ -0,0 +1,225 @@
+# backend/metrics.py
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Span duration histogram buckets (seconds), Prometheus-style upper bounds.
+SPAN_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Recent durations kept per span for p50/p95 in summary().
+RECENT_SAMPLES = 1000
+METRIC_PREFIX = "bazooka"
+
+_CURRENT_TRACE = contextvars.ContextVar("bazooka_trace", default=None)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Metrics:
+    """
+    Process-wide span timings and counters.
+    Every span feeds a duration histogram (exported for Prometheus) and a
+    window of recent samples (for p50/p95 in summary()); spans inside an
+    active Trace are also recorded there as events.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._spans = {}
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Time the enclosed block as span `name`; `attrs` go to the trace only."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                entry = self._spans.get(name)
+                if entry is None:
+                    entry = self._spans[name] = {
+                        "buckets": [0] * len(SPAN_BUCKETS),
+                        "count": 0,
+                        "sum": 0.0,
+                        "recent": deque(maxlen=RECENT_SAMPLES),
+                    }
+                index = bisect.bisect_left(SPAN_BUCKETS, duration)
+                if index < len(SPAN_BUCKETS):
+                    entry["buckets"][index] += 1
+                entry["count"] += 1
+                entry["sum"] += duration
+                entry["recent"].append(duration)
+            trace = _CURRENT_TRACE.get()
+            if trace is not None:
+                trace.add(name, start, duration, attrs)
+
+    def increment(self, name, value=1, **labels):
+        """Add `value` to counter `name` (with optional labels)."""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        trace = _CURRENT_TRACE.get()
+        if trace is not None:
+            trace.count(name, value)
+
+    def counter(self, name, **labels):
+        with self._lock:
+            return self._counters.get((name, _label_key(labels)), 0)
+
+    def summary(self):
+        """{span: {"count", "total_s", "p50_s", "p95_s"}} over recent samples."""
+        with self._lock:
+            return {
+                name: {
+                    "count": entry["count"],
+                    "total_s": entry["sum"],
+                    "p50_s": _percentile(entry["recent"], 0.5),
+                    "p95_s": _percentile(entry["recent"], 0.95),
+                }
+                for name, entry in sorted(self._spans.items())
+            }
+
+    def prometheus_text(self):
+        """All counters and span histograms in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            counter_names = sorted({name for name, _ in self._counters})
+            for name in counter_names:
+                metric = f"{METRIC_PREFIX}_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                for (counter_name, labels), value in sorted(self._counters.items()):
+                    if counter_name == name:
+                        lines.append(f"{metric}{_format_labels(labels)} {value}")
+
+            if self._spans:
+                metric = f"{METRIC_PREFIX}_span_seconds"
+                lines.append(f"# HELP {metric} Time spent in each pipeline span.")
+                lines.append(f"# TYPE {metric} histogram")
+            for name, entry in sorted(self._spans.items()):
+                cumulative = 0
+                for bound, count in zip(SPAN_BUCKETS, entry["buckets"]):
+                    cumulative += count
+                    lines.append(f"{metric}_bucket{_format_labels((('span', name), ('le', bound)))} {cumulative}")
+                lines.append(f"{metric}_bucket{_format_labels((('span', name), ('le', '+Inf')))} {entry['count']}")
+                lines.append(f"{metric}_sum{_format_labels((('span', name),))} {entry['sum']:.6f}")
+                lines.append(f"{metric}_count{_format_labels((('span', name),))} {entry['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Write prometheus_text() atomically (e.g. for node_exporter's textfile collector)."""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+        return path
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._spans.clear()
+
+
+class Trace:
+    """
+    Spans and counters of one run (one validation, one batch file).
+    Activate it around the work with `with trace.active():`; threads started
+    through propagate() record into it too. Exports Chrome trace JSON
+    (chrome://tracing, Perfetto).
+    """
+
+    def __init__(self, name="validation"):
+        self.name = name
+        self.events = []
+        self.counters = {}
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def active(self):
+        token = _CURRENT_TRACE.set(self)
+        try:
+            yield self
+        finally:
+            _CURRENT_TRACE.reset(token)
+
+    def add(self, name, start, duration, attrs):
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": round((start - self._origin) * 1e6, 1),
+            "dur": round(duration * 1e6, 1),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": {key: value if isinstance(value, (int, float, bool)) else str(value)
+                     for key, value in attrs.items()},
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def count(self, name, value):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        """[{"span", "count", "total_s", "max_s"}] ordered by first start time."""
+        rows = {}
+        with self._lock:
+            for event in sorted(self.events, key=lambda e: e["ts"]):
+                row = rows.setdefault(event["name"], {"span": event["name"], "count": 0, "total_s": 0.0, "max_s": 0.0})
+                row["count"] += 1
+                row["total_s"] += event["dur"] / 1e6
+                row["max_s"] = max(row["max_s"], event["dur"] / 1e6)
+        return list(rows.values())
+
+    def to_json(self):
+        with self._lock:
+            return json.dumps({
+                "traceEvents": list(self.events),
+                "displayTimeUnit": "ms",
+                "otherData": {"name": self.name, "counters": dict(self.counters)},
+            })
+
+    def write(self, path):
+        with open(path, "w") as f:
+            f.write(self.to_json())
+        return path
+
+
+def propagate(fn):
+    """
+    Wrap `fn` to run in a copy of the caller's context, so spans recorded in
+    executor/worker threads land in the caller's active Trace.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+    return run
+
+
+METRICS = Metrics()
+span = METRICS.span
+increment = METRICS.increment
@@ -0,0 +1,128 @@
+# backend/ocr_preprocess.py
+import cv2
+import numpy as np
+import os
+
+# Synchronous Textract calls reject larger payloads.
+TEXTRACT_MAX_BYTES = int(os.getenv("TEXTRACT_MAX_BYTES", 10 * 1024 * 1024))
+TEXTRACT_MAX_SIDE = 10000
+
+# Small print (ingredients, legal lines) is downscaled until it is about
+# this tall in pixels, a little above the ~15 px text height Textract
+# recommends; larger text just gets smaller. Never upscaled.
+TARGET_TEXT_HEIGHT = 16
+MIN_SCALE = 0.3
+CROP_MARGIN = 20
+
+
+def estimate_text_height(gray):
+    """
+    Estimate the pixel height of the smaller text on a page from the
+    connected components of a binarized image (20th percentile of glyph
+    heights). Returns None when nothing glyph-like is found.
+    """
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+    # Glyph-like: not specks, not rules/borders, not whole panels.
+    glyphs = (heights >= 6) & (heights <= 300) & (widths <= heights * 3)
+    if not np.any(glyphs):
+        return None
+    return float(np.percentile(heights[glyphs], 20))
+
+
+def _artwork_bounds(gray):
+    """Bounding box (x, y, w, h) of non-background pixels, with a margin."""
+    H, W = gray.shape[:2]
+    points = cv2.findNonZero((gray < 245).astype(np.uint8))
+    if points is None:
+        return 0, 0, W, H
+    x, y, w, h = cv2.boundingRect(points)
+    x0 = max(0, x - CROP_MARGIN)
+    y0 = max(0, y - CROP_MARGIN)
+    x1 = min(W, x + w + CROP_MARGIN)
+    y1 = min(H, y + h + CROP_MARGIN)
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def _encode(gray):
+    """Encode as grayscale PNG or high-quality JPEG, whichever is smaller."""
+    _, png = cv2.imencode(".png", gray, [cv2.IMWRITE_PNG_COMPRESSION, 6])
+    _, jpg = cv2.imencode(".jpg", gray, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return min(png, jpg, key=len).tobytes()
+
+
+def prepare_textract_image(image_bytes, target_text_height=TARGET_TEXT_HEIGHT, crop=False):
+    """
+    Shrink a page image before sending it to Textract: grayscale, optional
+    crop to the artwork bounds, downscale so small text is about
+    `target_text_height` px, and re-encode within TEXTRACT_MAX_BYTES.
+    Returns (payload bytes, transform); pass the transform to remap_geometry.
+    """
+    gray = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        raise ValueError("Could not decode image for Textract")
+    H, W = gray.shape[:2]
+
+    x, y, w, h = _artwork_bounds(gray) if crop else (0, 0, W, H)
+    region = gray[y:y + h, x:x + w]
+
+    scale = 1.0
+    text_height = estimate_text_height(region)
+    if text_height:
+        scale = min(1.0, max(MIN_SCALE, target_text_height / text_height))
+    scale = min(scale, TEXTRACT_MAX_SIDE / max(w, h))
+
+    while True:
+        if scale < 1.0:
+            size = (max(1, round(w * scale)), max(1, round(h * scale)))
+            resized = cv2.resize(region, size, interpolation=cv2.INTER_AREA)
+        else:
+            resized = region
+        payload = _encode(resized)
+        if len(payload) <= TEXTRACT_MAX_BYTES or scale <= MIN_SCALE:
+            break
+        scale = max(MIN_SCALE, scale * 0.8)
+
+    if scale >= 1.0 and (w, h) == (W, H) and len(image_bytes) <= min(len(payload), TEXTRACT_MAX_BYTES):
+        # Nothing to shrink and the original encoding is already smaller.
+        payload = image_bytes
+
+    transform = {
+        "width": W,
+        "height": H,
+        "crop": [x, y, w, h],
+        "scale": scale,
+    }
+    return payload, transform
+
+
+def remap_geometry(response, transform):
+    """
+    Rewrite the normalized BoundingBox/Polygon of every block in a Textract
+    response from the prepared payload's frame back to the original image.
+    Scaling alone leaves normalized coordinates unchanged; only the crop
+    needs undoing. Modifies and returns `response`.
+    """
+    W, H = transform["width"], transform["height"]
+    x, y, w, h = transform["crop"]
+    if (x, y, w, h) == (0, 0, W, H):
+        return response
+
+    sx, sy = w / W, h / H
+    ox, oy = x / W, y / H
+    for block in response.get("Blocks", []):
+        geometry = block.get("Geometry")
+        if not geometry:
+            continue
+        box = geometry.get("BoundingBox")
+        if box:
+            box["Left"] = ox + box["Left"] * sx
+            box["Top"] = oy + box["Top"] * sy
+            box["Width"] = box["Width"] * sx
+            box["Height"] = box["Height"] * sy
+        for point in geometry.get("Polygon", []):
+            point["X"] = ox + point["X"] * sx
+            point["Y"] = oy + point["Y"] * sy
+    return response
@@ -1,55 +1,278 @@
 # backend/ocr_service.py
 import boto3
-import json
-from pdf2image import convert_from_path
+import threading
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
+from pdf2image import convert_from_path, pdfinfo_from_path
 from dotenv import load_dotenv
 from PIL import Image
 import os
+from backend.cache_service import DiskCache, make_cache_key
+from backend.metrics import increment, propagate, span
+from backend.ocr_preprocess import TARGET_TEXT_HEIGHT, prepare_textract_image, remap_geometry
+from backend.rate_limiter import TokenBucket
+from backend.service_backends import backend_name, cache_key_parts, make_textract_client
+from backend.textract_store import save_textract, textract_path
 
 # Load environment variables from .env
 load_dotenv()
 
 Image.MAX_IMAGE_PIXELS = None  
 
-def pdf_to_image(pdf_path, output_path="page.png"):
+# Raw Textract responses keyed by image content + OCR settings, so re-uploads
+# and check-group changes never hit the network twice for the same artwork.
+OCR_CACHE = DiskCache(
+    os.getenv("OCR_CACHE_DIR", ".cache/ocr"),
+    max_bytes=int(os.getenv("OCR_CACHE_MAX_BYTES", 512 * 1024 * 1024)),
+    max_age=int(os.getenv("OCR_CACHE_MAX_AGE", 30 * 24 * 3600)),
+)
+
+# Rasterization DPI per downstream consumer; any function taking `dpi`
+# accepts either a number or one of these names.
+RASTER_DPI = {
+    "ocr": 300,
+    "detection": 300,
+    "preview": 100,
+}
+RASTER_WORKERS = min(4, os.cpu_count() or 1)
+
+# Image formats pdf_to_image can write, by output extension: (pdftoppm
+# format, extension pdftoppm gives the file).
+RASTER_FORMATS = {
+    ".png": ("png", "png"),
+    ".jpg": ("jpeg", "jpg"),
+    ".jpeg": ("jpeg", "jpg"),
+    ".tif": ("tiff", "tif"),
+    ".tiff": ("tiff", "tif"),
+}
+
+# Shared Textract client settings. "adaptive" retries back off on
+# ThrottlingException and rate-limit the client side as well.
+TEXTRACT_CLIENT_CONFIG = Config(
+    max_pool_connections=int(os.getenv("TEXTRACT_MAX_POOL_CONNECTIONS", 32)),
+    retries={
+        "mode": "adaptive",
+        "total_max_attempts": int(os.getenv("TEXTRACT_MAX_ATTEMPTS", 8)),
+    },
+    connect_timeout=10,
+    read_timeout=60,
+)
+
+_TEXTRACT_CLIENTS = {}
+_TEXTRACT_CLIENTS_LOCK = threading.Lock()
+
+# Process-wide DetectDocumentText budget; set TEXTRACT_TPS to the account's
+# quota. Only calls that reach Textract (cache misses) take a token.
+TEXTRACT_TPS = float(os.getenv("TEXTRACT_TPS", 5))
+TEXTRACT_RATE_LIMITER = TokenBucket(TEXTRACT_TPS)
+OCR_PAGE_WORKERS = int(os.getenv("OCR_PAGE_WORKERS", 8))
+
+
+def _resolve_dpi(dpi):
+    if isinstance(dpi, str):
+        if dpi not in RASTER_DPI:
+            raise ValueError(f"Unknown DPI profile: {dpi}")
+        return RASTER_DPI[dpi]
+    return dpi
+
+
+def _render_page(pdf_path, page, dpi, output_folder, output_file, fmt="png", extension="png"):
+    """
+    Render one PDF page with pdftoppm directly to
+    output_folder/output_file.extension (pdftoppm's extension for `fmt`).
+    The page is never decoded into memory here.
+    """
+    with span("rasterize.page", page=page, dpi=dpi):
+        convert_from_path(
+            pdf_path,
+            dpi=dpi,
+            first_page=page,
+            last_page=page,
+            output_folder=output_folder,
+            output_file=output_file,
+            single_file=True,
+            fmt=fmt,
+            paths_only=True,
+        )
+    return os.path.join(output_folder, f"{output_file}.{extension}")
+
+
+def pdf_to_image(pdf_path, output_path="page.png", page=1, dpi=300):
     """
-    Convert the first page of a PDF to an image (PNG).
+    Convert one page (default the first) of a PDF to an image, in the format
+    named by `output_path`'s extension (see RASTER_FORMATS).
+    Raises ValueError for any other extension.
     """
-    images = convert_from_path(pdf_path, dpi=300)
-    images[0].save(output_path, "PNG")
+    output_folder, file_name = os.path.split(os.path.abspath(output_path))
+    stem, ext = os.path.splitext(file_name)
+    if ext.lower() not in RASTER_FORMATS:
+        raise ValueError(f"Unsupported image extension {ext!r}; use one of {', '.join(RASTER_FORMATS)}")
+    fmt, extension = RASTER_FORMATS[ext.lower()]
+    rendered = _render_page(pdf_path, page, _resolve_dpi(dpi), output_folder, stem, fmt, extension)
+    if os.path.basename(rendered) != file_name:
+        os.replace(rendered, output_path)
     return output_path
 
 
-def extract_text_aws(image_path, region=None):
+def rasterize_pdf(pdf_path, output_dir, pages=None, dpi=300, workers=None):
     """
-    Extract text from an image using AWS Textract.
-    Credentials are loaded from .env or AWS CLI config.
+    Render selected PDF pages (1-based, default all) to PNG files in output_dir.
+    Each page is its own pdftoppm run written straight to disk, with up to
+    `workers` pages in flight, so memory stays bounded by one page per worker.
+    Returns the image paths in the order of `pages`.
     """
+    dpi = _resolve_dpi(dpi)
+    if pages is None:
+        pages = range(1, pdfinfo_from_path(pdf_path)["Pages"] + 1)
+    pages = list(pages)
+    os.makedirs(output_dir, exist_ok=True)
+
+    stem = os.path.splitext(os.path.basename(pdf_path))[0]
+
+    def render(page):
+        return _render_page(pdf_path, page, dpi, output_dir, f"{stem}_p{page}_{dpi}dpi")
 
+    workers = workers or RASTER_WORKERS
+    with span("rasterize", pages=len(pages)):
+        if workers > 1 and len(pages) > 1:
+            with ThreadPoolExecutor(max_workers=min(workers, len(pages))) as executor:
+                return list(executor.map(propagate(render), pages))
+        return [render(page) for page in pages]
+
+
+def get_textract_client(region=None):
+    """
+    Return the process-wide Textract client for a region.
+    boto3 clients are thread-safe, so concurrent validations share one
+    client and its pool of warm connections.
+    The live client is wrapped or replaced by the backend selected in the
+    environment (see service_backends: live, record or replay).
+    """
     # Default to env variable or fallback region
     region_name = region or os.getenv("AWS_DEFAULT_REGION", "us-east-1")
 
-    # Initialize Textract client with credentials
-    textract = boto3.client(
-        "textract",
-        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-        region_name=region_name,
-    )
+    def live_client():
+        # Initialize Textract client with credentials
+        return boto3.client(
+            "textract",
+            aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+            aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+            region_name=region_name,
+            config=TEXTRACT_CLIENT_CONFIG,
+        )
+
+    key = (backend_name("textract"), region_name)
+    with _TEXTRACT_CLIENTS_LOCK:
+        client = _TEXTRACT_CLIENTS.get(key)
+        if client is None:
+            client = _TEXTRACT_CLIENTS[key] = make_textract_client(live_client)
+    return client
+
+
+def detect_document(image_path, region=None, client=None, rate_limiter=None, use_cache=True,
+                    preprocess=True, crop=False):
+    """
+    Run Textract DetectDocumentText on an image and return the raw response.
+    `client` defaults to the shared client for `region`; any object with a
+    compatible detect_document_text() (e.g. a local stub) can be passed.
+    With `preprocess`, the payload is shrunk by prepare_textract_image first
+    (optionally cropped to the artwork); block geometry in the returned
+    response is always relative to the original image.
+    Responses are cached in OCR_CACHE by image hash; a hit skips Textract.
+    Replies from the replay backend are cached apart from real ones.
+    The raw response is also saved beside the image in the compact
+    Textract store (see textract_store.textract_path).
+    """
 
     with open(image_path, "rb") as document:
         image_bytes = document.read()
 
-    response = textract.detect_document_text(Document={"Bytes": image_bytes})
+    ocr_settings = {"api": "detect_document_text"}
+    if preprocess:
+        ocr_settings["preprocess"] = {"target_text_height": TARGET_TEXT_HEIGHT, "crop": crop}
+    cache_key = make_cache_key(image_bytes, ocr_settings, *cache_key_parts("textract", client))
+    response = OCR_CACHE.get(cache_key) if use_cache else None
+    if use_cache:
+        increment("ocr_cache_hits" if response is not None else "ocr_cache_misses")
+
+    if response is None:
+        payload, transform = image_bytes, None
+        if preprocess:
+            with span("ocr.preprocess"):
+                payload, transform = prepare_textract_image(image_bytes, crop=crop)
 
+        textract = client or get_textract_client(region)
+        if rate_limiter is not None:
+            with span("ocr.rate_limit_wait"):
+                rate_limiter.acquire()
+        with span("ocr.textract", payload_bytes=len(payload)):
+            response = textract.detect_document_text(Document={"Bytes": payload})
+        increment("textract_calls")
+        increment("textract_payload_bytes", len(payload))
+        if transform is not None:
+            response = remap_geometry(response, transform)
+        if use_cache:
+            OCR_CACHE.set(cache_key, response)
+
+    # Save raw response in the compact store
+    save_textract(response, textract_path(image_path))
+
+    return response
+
+
+def response_text(response):
+    """Join the LINE blocks of a Textract response with newlines."""
     # Extract only text lines
-    text = "\n".join(
+    return "\n".join(
         [block["Text"] for block in response["Blocks"] if block["BlockType"] == "LINE"]
     )
 
-    # Save raw response as JSON file
-    json_path = image_path.replace(".png", ".json")
-    with open(json_path, "w") as f:
-        json.dump(response, f, indent=2)
 
-    return text
+def extract_text_aws(image_path, region=None, use_cache=True, client=None):
+    """
+    Extract text from an image using AWS Textract.
+    Credentials are loaded from .env or AWS CLI config.
+    """
+    response = detect_document(
+        image_path, region=region, client=client, rate_limiter=TEXTRACT_RATE_LIMITER, use_cache=use_cache
+    )
+    return response_text(response)
+
+
+def extract_text_pages(image_paths, region=None, client=None, rate_limiter=None, workers=None, use_cache=True,
+                       pages=None):
+    """
+    OCR page images concurrently, with Textract calls paced by `rate_limiter`
+    (default: the shared TEXTRACT_RATE_LIMITER token bucket).
+    `pages` are the 1-based PDF page numbers of the images, e.g. the `pages`
+    given to rasterize_pdf(); by default the images are pages 1..n.
+    Returns [{"page", "image_path", "text", "blocks"}] in the order given.
+    """
+    image_paths = list(image_paths)
+    pages = list(pages) if pages is not None else list(range(1, len(image_paths) + 1))
+    if len(pages) != len(image_paths):
+        raise ValueError(f"Got {len(pages)} page numbers for {len(image_paths)} images")
+    rate_limiter = rate_limiter or TEXTRACT_RATE_LIMITER
+    workers = workers or OCR_PAGE_WORKERS
+
+    def ocr_page(image_path):
+        return detect_document(
+            image_path, region=region, client=client, rate_limiter=rate_limiter, use_cache=use_cache
+        )
+
+    with span("ocr", pages=len(image_paths)):
+        if workers > 1 and len(image_paths) > 1:
+            with ThreadPoolExecutor(max_workers=min(workers, len(image_paths))) as executor:
+                responses = list(executor.map(propagate(ocr_page), image_paths))
+        else:
+            responses = [ocr_page(image_path) for image_path in image_paths]
+
+    return [
+        {
+            "page": page,
+            "image_path": image_path,
+            "text": response_text(response),
+            "blocks": response["Blocks"],
+        }
+        for page, image_path, response in zip(pages, image_paths, responses)
+    ]
@@ -0,0 +1,132 @@
+# backend/pipeline.py
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from backend.ocr_service import extract_text_pages, rasterize_pdf
+from backend.image_detecter import detect_kosher_symbol
+from backend.layout_index import LineIndex
+from backend.llm_service import stream_validation
+from backend.metrics import propagate, span
+
+# Appended to the prompt text when the artwork shows a Kosher mark, so the
+# model sees what OCR alone cannot.
+KOSHER_NOTE = "Kosher symbol detected"
+
+
+@contextmanager
+def timed(timings, stage):
+    """
+    Record the wall time of the enclosed block in timings[stage] (seconds),
+    also as the metrics span "pipeline.<stage>".
+    """
+    start = time.perf_counter()
+    try:
+        with span(f"pipeline.{stage}"):
+            yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+def detect_page(image_path, page, **detect_kwargs):
+    """Symbols found on one page image, each tagged with its 1-based page."""
+    return [
+        {**sym, "page": page}
+        for sym in detect_kosher_symbol(image_path, **detect_kwargs) if "symbol" in sym
+    ]
+
+
+def _detect_pages(image_paths, detect_kwargs):
+    symbols = []
+    for page, image_path in enumerate(image_paths, start=1):
+        symbols.extend(detect_page(image_path, page, **detect_kwargs))
+    return symbols
+
+
+def analyze_document(file_path, pages_dir="temp_pages", ocr_kwargs=None, detect_kwargs=None, detector=None):
+    """
+    Rasterize a PDF (images are used as-is), then run OCR and Kosher symbol
+    detection side by side: OCR waits on Textract while detection keeps the
+    CPU busy, so this stage takes about max(OCR, detection).
+    `detector(image_paths)` replaces full-page detection when given (see
+    version_diff.analyze_revision).
+    Returns a dict with image_paths, ocr_pages, ocr_text, layout (LineIndex),
+    symbols (each with its "page") and timings (seconds per stage:
+    rasterize, ocr, detection and analyze, the wall time of the overlapped
+    pair).
+    Errors from either branch are raised once both have finished.
+    """
+    timings = {}
+    with timed(timings, "rasterize"):
+        if file_path.lower().endswith(".pdf"):
+            image_paths = rasterize_pdf(file_path, pages_dir, dpi="ocr")
+        else:
+            image_paths = [file_path]
+
+    def ocr():
+        with timed(timings, "ocr"):
+            return extract_text_pages(image_paths, **(ocr_kwargs or {}))
+
+    def detect():
+        with timed(timings, "detection"):
+            if detector is not None:
+                return detector(image_paths)
+            return _detect_pages(image_paths, detect_kwargs or {})
+
+    with timed(timings, "analyze"):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            ocr_future = executor.submit(propagate(ocr))
+            detect_future = executor.submit(propagate(detect))
+            # Join both before raising, so a failing branch never leaves the
+            # other running behind the caller's back.
+            ocr_error = ocr_future.exception()
+            detect_error = detect_future.exception()
+        if ocr_error or detect_error:
+            raise ocr_error or detect_error
+        ocr_pages = ocr_future.result()
+        symbols = detect_future.result()
+
+    return {
+        "image_paths": image_paths,
+        "ocr_pages": ocr_pages,
+        "ocr_text": "\n".join(page["text"] for page in ocr_pages),
+        "layout": LineIndex.from_pages(ocr_pages),
+        "symbols": symbols,
+        "timings": timings,
+    }
+
+
+def prompt_notes(analysis):
+    """Lines added after the OCR text in the prompt: a detected Kosher symbol."""
+    return [KOSHER_NOTE] if analysis["symbols"] else []
+
+
+def stream_document_validation(analysis, check_group="All", **validation_kwargs):
+    """
+    stream_validation() over an analyze_document() result, recording the
+    time to the final report in analysis["timings"]["validation"].
+    """
+    with timed(analysis["timings"], "validation"):
+        yield from stream_validation(
+            analysis["ocr_text"],
+            check_group,
+            symbols=analysis["symbols"],
+            layout=analysis["layout"],
+            notes=prompt_notes(analysis),
+            **validation_kwargs,
+        )
+
+
+def run_pipeline(file_path, check_group="All", pages_dir="temp_pages", ocr_kwargs=None, detect_kwargs=None,
+                 **validation_kwargs):
+    """
+    Full run without streaming: analyze_document() followed by validation.
+    Returns the analysis dict with "validation" (a ValidationResult) added
+    and timings["total"] set.
+    """
+    start = time.perf_counter()
+    analysis = analyze_document(file_path, pages_dir, ocr_kwargs, detect_kwargs)
+    for kind, item in stream_document_validation(analysis, check_group, **validation_kwargs):
+        if kind == "result":
+            analysis["validation"] = item
+    analysis["timings"]["total"] = time.perf_counter() - start
+    return analysis
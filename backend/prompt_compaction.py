@@ -0,0 +1,136 @@
+# backend/prompt_compaction.py
+import difflib
+import math
+import os
+import re
+
+# Whole-line proofing/print annotations that are never packaging copy.
+# Kept narrow on purpose: "ARTIFICIAL COLOR" or "SAFETY WARNING" must survive.
+PROOF_LINE_PATTERNS = [re.compile(p, re.IGNORECASE) for p in (
+    r"\bPROOF\s*#",
+    r"^PROOF\b",
+    r"\bDIE\s*-?\s*LINE\b",
+    r"\bCROP\s*MARKS?\b",
+    r"\bREGISTRATION\s+MARKS?\b",
+    r"\bPANTONE\b",
+    r"^PMS\s*\d",
+    r"^(?:CMYK|SPOT)\b",
+    r"^COLOU?RS?\s*(?:[:#]|\d+\s*$|$)",
+    r"^(?:REEZE|TABLE|BLEED|TRIM|SAFE\s*AREA|KEYLINE)\s*$",
+    r"\bDO\s+NOT\s+PRINT\b",
+    r"\bNON[- ]?PRINTING\b",
+    r"\bFOR\s+POSITION\s+ONLY\b|^FPO$",
+    r"^(?:JOB|CLIENT|ARTIST|DESIGNER|PRINTER|SUBSTRATE|SCALE|DATE)\s*#?\s*:",
+    r"^REV(?:ISION)?\.?\s*#?\s*\d+\s*$",
+)]
+
+NEAR_DUPLICATE_RATIO = 0.9
+MIN_NEAR_DUPLICATE_LENGTH = 8
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 6000))
+
+# Gemini averages roughly four characters of English per token.
+CHARS_PER_TOKEN = 4
+
+
+def normalize_newlines(text: str) -> str:
+    # Collapse 3+ newlines into 2 (paragraph separation)
+    text = re.sub(r'\n{3,}', '\n', text)
+    # Collapse multiple spaces/tabs
+    text = re.sub(r'[ \t]+', ' ', text)
+    return text.strip()
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap offline token estimate for budgeting and reporting."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def is_proof_annotation(line: str) -> bool:
+    """True when a line is proofing/print vocabulary rather than package copy."""
+    return any(pattern.search(line) for pattern in PROOF_LINE_PATTERNS)
+
+
+def _line_key(line):
+    return re.sub(r"[^a-z0-9]", "", line.lower())
+
+
+def compact_ocr_text(text: str, token_budget: int = PROMPT_TOKEN_BUDGET, notes=()):
+    """
+    Shrink OCR text before it goes into a prompt: normalize whitespace, drop
+    proof annotations, collapse duplicate and near-duplicate lines (repeated
+    copy on multi-panel art), then cut lines that would exceed
+    `token_budget` (None for no limit). `notes` (e.g. "Kosher symbol
+    detected") are appended after compaction and never cut; their tokens
+    come out of the budget first.
+    Returns (compacted text, stats) where stats reports the estimated tokens
+    before/after/saved and how many lines each step removed.
+    """
+    lines = normalize_newlines(text).split("\n")
+
+    kept = []
+    kept_keys = set()
+    by_length = {}  # key length bucket -> keys, for near-duplicate lookups
+    proof_removed = 0
+    duplicates_removed = 0
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if is_proof_annotation(line):
+            proof_removed += 1
+            continue
+
+        key = _line_key(line)
+        if key in kept_keys:
+            duplicates_removed += 1
+            continue
+
+        if len(key) >= MIN_NEAR_DUPLICATE_LENGTH:
+            bucket = len(key) // MIN_NEAR_DUPLICATE_LENGTH
+            candidates = (
+                other for b in (bucket - 1, bucket, bucket + 1) for other in by_length.get(b, ())
+            )
+            digits = re.sub(r"\D", "", key)
+            matcher = difflib.SequenceMatcher(None, "", key)
+            near_duplicate = False
+            for other in candidates:
+                # Lines that differ in any number (weights, counts, phone
+                # numbers) are never merged.
+                if re.sub(r"\D", "", other) != digits:
+                    continue
+                matcher.set_seq1(other)
+                if matcher.quick_ratio() >= NEAR_DUPLICATE_RATIO and matcher.ratio() >= NEAR_DUPLICATE_RATIO:
+                    near_duplicate = True
+                    break
+            if near_duplicate:
+                duplicates_removed += 1
+                continue
+            by_length.setdefault(bucket, []).append(key)
+
+        kept_keys.add(key)
+        kept.append(line)
+
+    truncated = 0
+    notes = [note for note in notes if note]
+    if token_budget is not None:
+        used = sum(estimate_tokens(note + "\n") for note in notes)
+        for i, line in enumerate(kept):
+            used += estimate_tokens(line + "\n")
+            if used > token_budget:
+                truncated = len(kept) - i
+                kept = kept[:i]
+                break
+
+    compacted = "\n".join(kept + notes)
+    tokens_before = estimate_tokens("\n".join([text, *notes]))
+    tokens_after = estimate_tokens(compacted)
+    stats = {
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "tokens_saved": tokens_before - tokens_after,
+        "proof_lines_removed": proof_removed,
+        "duplicate_lines_removed": duplicates_removed,
+        "truncated_lines": truncated,
+    }
+    return compacted, stats
@@ -0,0 +1,223 @@
+# backend/rule_engine.py
+import difflib
+import re
+
+# OCR-tolerant patterns for label elements that can be checked exactly.
+AGES_PATTERN = re.compile(r"\bAGES?\s*[4A]\s*\+|\b4\s*\+\s*AGES?\b", re.IGNORECASE)
+NET_WEIGHT_PATTERN = re.compile(r"\bNET\.?\s*(?:WT|W[E3]IGHT)\b", re.IGNORECASE)
+UNIT_COUNT_PATTERN = re.compile(
+    r"\b\d+\s*(?:CT|COUNT|PCS?|PIECES?|RINGS?|POPS?|BARS?|PACKS?|UNITS?|BAGS?)\b\.?", re.IGNORECASE
+)
+KOSHER_TEXT_PATTERN = re.compile(r"\bKOSHER\b", re.IGNORECASE)
+# A Kosher mark read as text on a line of its own: "OU", "(U)", "Ⓤ", "K", "OU-D".
+KOSHER_MARK_PATTERN = re.compile(r"^\W*(?:O\s*U|U|K|Ⓤ|Ⓚ)(?:\W*[DP])?\W*$", re.IGNORECASE | re.MULTILINE)
+# The product name on a line of its own ("BAZOOKA BUBBLE GUM"), not the
+# distributor line ("The Bazooka Companies, Inc.") or "gum arabic".
+BAZOOKA_GUM_PATTERN = re.compile(r"^\W*BAZOOKA\b.*\bGUM\b", re.IGNORECASE | re.MULTILINE)
+BAZOOKA_MENTION_PATTERN = re.compile(r"\bBAZOOKA\b", re.IGNORECASE)
+GUM_PATTERN = re.compile(r"\bGUM\b", re.IGNORECASE)
+GELATIN_NEGATION_PATTERN = re.compile(r"\b(?:NO|WITHOUT)\s+$|^\s*-?\s*FREE\b", re.IGNORECASE)
+MANUFACTURER_PATTERN = re.compile(
+    r"\b(?:DISTRIBUTED|MANUFACTURED|MFD\.?|DIST\.?|PACKED|IMPORTED)\s+(?:EXCLUSIVELY\s+)?(?:BY|FOR)\b", re.IGNORECASE
+)
+# The legal line itself ("© 2024 ...", "... is a registered trademark of
+# ...", "All rights reserved"), not a brand mark such as "RING POP®".
+LEGAL_IP_PATTERN = re.compile(
+    r"(?:©|\(C\)|\bCOPYRIGHT\b)\s*\d{4}|\bTRADEMARKS?\s+OF\b|\bREGISTERED\s+TRADEMARK|\bALL RIGHTS RESERVED",
+    re.IGNORECASE,
+)
+COUNTRY_OF_ORIGIN_PATTERN = re.compile(r"\b(?:MADE|PRODUCED|MANUFACTURED)\s+IN\b|\bPRODUCT\s+OF\b", re.IGNORECASE)
+
+# "At the bottom" means within this fraction of the page's text extent.
+BOTTOM_FRACTION = 0.2
+
+GELATIN_WORDS = ("GELATIN", "GELATINE")
+GELATIN_MIN_RATIO = 0.8
+WORD_PATTERN = re.compile(r"[A-Za-z0-9]+")
+
+
+def find_gelatin(ocr_text):
+    """
+    Return the first word that reads as 'Gelatin'/'Gelatine', allowing OCR
+    misspellings such as 'Gelatan' or 'Gelatln', or None. Mentions like
+    'no gelatin' / 'gelatin free' are ignored.
+    """
+    for match in WORD_PATTERN.finditer(ocr_text):
+        word = match.group().upper()
+        if not 6 <= len(word) <= 9 or not word.startswith("GE"):
+            continue
+        ratio = max(difflib.SequenceMatcher(None, word, target).ratio() for target in GELATIN_WORDS)
+        if ratio < GELATIN_MIN_RATIO:
+            continue
+        before = ocr_text[max(0, match.start() - 10):match.start()]
+        after = ocr_text[match.end():match.end() + 10]
+        if GELATIN_NEGATION_PATTERN.search(before) or GELATIN_NEGATION_PATTERN.search(after):
+            continue
+        return match.group()
+    return None
+
+
+def kosher_evidence(ocr_text, symbols=None):
+    """Describe why the package shows a Kosher mark, or return None."""
+    detected = [s["symbol"] for s in symbols or [] if "symbol" in s]
+    if detected:
+        return f"Kosher symbol detected on the artwork ({detected[0]})"
+    if KOSHER_TEXT_PATTERN.search(ocr_text):
+        return "the OCR text mentions 'Kosher'"
+    mark = KOSHER_MARK_PATTERN.search(ocr_text)
+    if mark:
+        return f"the OCR text shows the Kosher mark '{mark.group().strip()}'"
+    return None
+
+
+def _at_bottom(layout, pattern):
+    """First line matching `pattern` in the bottom band of its page, or None."""
+    bottom = set(layout.bottom(BOTTOM_FRACTION))
+    return next((line for line in layout.find(pattern) if line in bottom), None)
+
+
+def _first_below(layout, pattern, reference_pattern):
+    """
+    First (line, reference) pair where a `pattern` line sits below a
+    `reference_pattern` line on the same page, or None.
+    """
+    references = layout.find(reference_pattern)
+    for line in layout.find(pattern):
+        for reference in references:
+            if layout.is_below(line, reference):
+                return line, reference
+    return None
+
+
+def _last_per_page(layout, pattern):
+    """The bottom-most line matching `pattern` on each page."""
+    last = {}
+    for line in layout.find(pattern):
+        last[line.page] = line
+    return list(last.values())
+
+
+def _check_ages_at_bottom(ocr_text, symbols, layout):
+    if not AGES_PATTERN.search(ocr_text):
+        # Only the Front rule exempts Bazooka gum.
+        product = BAZOOKA_GUM_PATTERN.search(ocr_text)
+        if product is not None:
+            return "PASS", f"'Ages 4+' is not required on Bazooka gum ('{product.group().strip()}')."
+        if BAZOOKA_MENTION_PATTERN.search(ocr_text) and GUM_PATTERN.search(ocr_text):
+            # Bazooka and gum are both mentioned, but not as the product
+            # name: let the model decide whether the exemption applies.
+            return None
+        return "FAIL", "'Ages 4+' was not found in the OCR text."
+    if layout is None:
+        return None
+    line = _at_bottom(layout, AGES_PATTERN)
+    if line is not None:
+        return "PASS", f"'{line.text}' appears at the bottom of the panel."
+    # Present but not in the bottom band: let the model weigh the layout.
+    return None
+
+
+def _check_ages_below_manufacturer(ocr_text, symbols, layout):
+    if not AGES_PATTERN.search(ocr_text):
+        return "FAIL", "'Ages 4+' was not found in the OCR text."
+    if layout is None:
+        return None
+    pair = _first_below(layout, AGES_PATTERN, MANUFACTURER_PATTERN)
+    if pair is not None:
+        return "PASS", f"'{pair[0].text}' appears below '{pair[1].text}'."
+    return None
+
+
+def _check_net_weight(ocr_text, symbols, layout):
+    if not NET_WEIGHT_PATTERN.search(ocr_text):
+        return "FAIL", "No Net Weight statement was found in the OCR text."
+    line = _at_bottom(layout, NET_WEIGHT_PATTERN) if layout is not None else None
+    if line is not None:
+        return "PASS", f"'{line.text}' appears at the bottom of the panel."
+    return None
+
+
+def _check_unit_count(ocr_text, symbols, layout):
+    if not UNIT_COUNT_PATTERN.search(ocr_text):
+        return "FAIL", "No unit count was found in the OCR text."
+    line = _at_bottom(layout, UNIT_COUNT_PATTERN) if layout is not None else None
+    if line is not None:
+        return "PASS", f"'{line.text}' appears at the bottom of the panel."
+    return None
+
+
+def _check_manufacturer_after_ip(ocr_text, symbols, layout):
+    if not MANUFACTURER_PATTERN.search(ocr_text):
+        return "FAIL", "No manufacturer/distributor statement was found in the OCR text."
+    if layout is None:
+        return None
+    # The statement must follow the whole legal block, so compare against
+    # the last legal line on the page.
+    for legal in _last_per_page(layout, LEGAL_IP_PATTERN):
+        line = next((l for l in layout.find(MANUFACTURER_PATTERN, legal.page) if layout.is_below(l, legal)), None)
+        if line is not None:
+            return "PASS", f"'{line.text}' follows the legal IP line '{legal.text}'."
+    return None
+
+
+def _check_country_of_origin(ocr_text, symbols, layout):
+    if not COUNTRY_OF_ORIGIN_PATTERN.search(ocr_text):
+        return "FAIL", "No country of origin statement was found in the OCR text."
+    if layout is None:
+        return None
+    pair = _first_below(layout, COUNTRY_OF_ORIGIN_PATTERN, MANUFACTURER_PATTERN)
+    if pair is not None:
+        return "PASS", f"'{pair[0].text}' appears below '{pair[1].text}'."
+    return None
+
+
+def _check_gelatin_kosher(ocr_text, symbols, layout):
+    gelatin = find_gelatin(ocr_text)
+    if gelatin is None:
+        return "PASS", "No Gelatin/Gelatine was found in the OCR text."
+    kosher = kosher_evidence(ocr_text, symbols)
+    if kosher is None:
+        # A mark can be missed by both the template match and OCR; let the
+        # model look at the text before passing.
+        return None
+    return "FAIL", f"'{gelatin}' is listed and {kosher}."
+
+
+# (pattern over the rule text, evaluator). An evaluator returns
+# (result, reason) when it can decide the rule, or None to defer to the LLM.
+# Positional rules need a LineIndex; without one only absence is decided.
+LOCAL_RULES = [
+    (re.compile(r"'Ages 4\+' appears at the bottom", re.IGNORECASE), _check_ages_at_bottom),
+    (re.compile(r"'Ages 4\+' appears below manufacturer", re.IGNORECASE), _check_ages_below_manufacturer),
+    (re.compile(r"Net Weight", re.IGNORECASE), _check_net_weight),
+    (re.compile(r"unit count", re.IGNORECASE), _check_unit_count),
+    (re.compile(r"manufacturer/distributor information after legal IP line", re.IGNORECASE),
+     _check_manufacturer_after_ip),
+    (re.compile(r"country of origin below manufacturer", re.IGNORECASE), _check_country_of_origin),
+    (re.compile(r"Gelatin", re.IGNORECASE), _check_gelatin_kosher),
+]
+
+
+def evaluate_rules(rules, ocr_text, symbols=None, layout=None):
+    """
+    Evaluate the rules the engine can decide exactly.
+    `layout` is an optional LineIndex over the OCR lines, used for rules
+    about where text sits on the package.
+    Returns (resolved, unresolved): resolved maps rule text to a check dict
+    in the LLM's schema ({"rule", "result", "reason"}); unresolved lists the
+    rules to forward to the LLM, in their original order.
+    """
+    resolved = {}
+    unresolved = []
+    for rule in rules:
+        outcome = None
+        for pattern, evaluator in LOCAL_RULES:
+            if pattern.search(rule):
+                outcome = evaluator(ocr_text, symbols, layout)
+                break
+        if outcome is None:
+            unresolved.append(rule)
+        else:
+            result, reason = outcome
+            resolved[rule] = {"rule": rule, "result": result, "reason": reason}
+    return resolved, unresolved
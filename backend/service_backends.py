@@ -0,0 +1,309 @@
+# backend/service_backends.py
+"""
+Pluggable Textract and Gemini backends.
+
+SERVICE_BACKEND (or TEXTRACT_BACKEND / GEMINI_BACKEND per service) selects:
+  live    call the real services (default)
+  record  call the real services and save every reply under
+          SERVICE_RECORDINGS_DIR
+  replay  serve saved replies with no network or credentials, adding
+          REPLAY_LATENCY seconds ("0.8" or a "0.2-1.5" range) per call and
+          failing REPLAY_ERROR_RATE of calls (0..1), seeded by REPLAY_SEED
+
+Replies are looked up by request content. A replayed Textract request
+with no exact recording gets one of the recorded responses, picked by a
+hash of the request. A replayed Gemini prompt with no recording is
+answered rule by rule from every recorded or imported check. So a few
+captures are enough to load-test any artwork.
+
+    python -m backend.service_backends import bazooka/v1.textract.npz results.json
+"""
+import glob
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from backend.textract_store import STORE_SUFFIX, load_textract, save_textract
+
+BACKENDS = ("live", "record", "replay")
+RECORDINGS_DIR = ".recordings"
+# Streamed replays are cut into chunks of this many characters.
+REPLAY_CHUNK_CHARS = 64
+
+
+def backend_name(service):
+    """Backend selected for "textract" or "gemini" from the environment."""
+    name = os.getenv(f"{service.upper()}_BACKEND") or os.getenv("SERVICE_BACKEND", "live")
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown {service} backend: {name} (expected one of {', '.join(BACKENDS)})")
+    return name
+
+
+def cache_key_parts(service, client=None):
+    """
+    Extra cache-key parts for `service`'s replies. Replayed replies (which
+    may be another artwork's or a synthetic FAIL) get their own namespace,
+    so they are never served to live runs; recorded ones are real replies
+    and share the live keys. With `client`, the namespace follows that
+    client (replay clients set `replay = True`) instead of the environment.
+    """
+    if client is not None:
+        return ("replay",) if getattr(client, "replay", False) else ()
+    return ("replay",) if backend_name(service) == "replay" else ()
+
+
+def recordings_dir(service):
+    return os.path.join(os.getenv("SERVICE_RECORDINGS_DIR", RECORDINGS_DIR), service)
+
+
+def parse_latency(spec):
+    """'0.5' -> (0.5, 0.5); '0.2-1.5' -> (0.2, 1.5); empty -> (0, 0)."""
+    if not spec:
+        return 0.0, 0.0
+    low, _, high = str(spec).partition("-")
+    return float(low), float(high or low)
+
+
+class InjectedError(RuntimeError):
+    """Failure raised by a replay backend's error injection."""
+
+
+class Faults:
+    """Latency and error injection shared by the replay backends."""
+
+    def __init__(self, latency=None, error_rate=None, seed=None, sleep=time.sleep):
+        self.latency = parse_latency(os.getenv("REPLAY_LATENCY") if latency is None else latency)
+        self.error_rate = float(os.getenv("REPLAY_ERROR_RATE", 0) if error_rate is None else error_rate)
+        seed = os.getenv("REPLAY_SEED") if seed is None else seed
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._sleep = sleep
+
+    def apply(self, service, timeout=None):
+        """Sleep for the injected latency, then maybe raise an InjectedError."""
+        with self._lock:
+            delay = self._random.uniform(*self.latency)
+            fail = self._random.random() < self.error_rate
+        if timeout is not None and delay > timeout:
+            self._sleep(timeout)
+            raise TimeoutError(f"{service} replay exceeded the {timeout:g}s timeout")
+        self._sleep(delay)
+        if fail:
+            raise InjectedError(f"Injected {service} failure")
+
+
+def _key(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+    return digest.hexdigest()
+
+
+# --------------------------
+# Textract
+# --------------------------
+def _textract_path(directory, key):
+    return os.path.join(directory, key + STORE_SUFFIX)
+
+
+class RecordingTextract:
+    """Live client wrapper that saves every DetectDocumentText reply."""
+
+    def __init__(self, client, directory=None):
+        self.client = client
+        self.directory = directory or recordings_dir("textract")
+
+    def detect_document_text(self, Document):
+        response = self.client.detect_document_text(Document=Document)
+        os.makedirs(self.directory, exist_ok=True)
+        save_textract(response, _textract_path(self.directory, _key(Document["Bytes"])))
+        return response
+
+
+class ReplayTextract:
+    """DetectDocumentText served from recordings, with injected faults."""
+
+    replay = True
+
+    def __init__(self, directory=None, faults=None):
+        self.directory = directory or recordings_dir("textract")
+        self.faults = faults or Faults()
+        self.recordings = sorted(glob.glob(os.path.join(self.directory, "*" + STORE_SUFFIX)))
+        if not self.recordings:
+            raise FileNotFoundError(f"No Textract recordings in {self.directory}")
+
+    def detect_document_text(self, Document):
+        key = _key(Document["Bytes"])
+        path = _textract_path(self.directory, key)
+        if not os.path.exists(path):
+            path = self.recordings[int(key, 16) % len(self.recordings)]
+        self.faults.apply("Textract")
+        with load_textract(path) as stored:
+            return stored.response()
+
+
+def make_textract_client(live_factory):
+    """Textract client for the selected backend; `live_factory()` builds the boto3 client."""
+    name = backend_name("textract")
+    if name == "replay":
+        return ReplayTextract()
+    if name == "record":
+        return RecordingTextract(live_factory())
+    return live_factory()
+
+
+# --------------------------
+# Gemini
+# --------------------------
+RULES_SECTION_PATTERN = re.compile(r"Rules to check:\n(.*?)\n\n", re.DOTALL)
+
+
+def prompt_rules(prompt):
+    """Rules listed in a validation prompt, in order."""
+    match = RULES_SECTION_PATTERN.search(prompt)
+    if not match:
+        return []
+    return [line[2:] for line in match.group(1).splitlines() if line.startswith("- ") and not line.startswith("- (none")]
+
+
+class _Reply:
+    def __init__(self, text):
+        self.text = text
+
+
+def model_reply(text, stream=False):
+    """
+    `text` as GenerativeModel.generate_content returns it: one reply, or
+    with `stream` a list of REPLAY_CHUNK_CHARS-sized chunks.
+    """
+    if stream:
+        return [_Reply(text[i:i + REPLAY_CHUNK_CHARS]) for i in range(0, len(text), REPLAY_CHUNK_CHARS)]
+    return _Reply(text)
+
+
+class RecordingModel:
+    """Live model wrapper that saves each reply (streamed ones once complete)."""
+
+    def __init__(self, model, model_name, directory=None):
+        self.model = model
+        self.model_name = model_name
+        self.directory = directory or recordings_dir("gemini")
+
+    def _save(self, prompt, text):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, _key(self.model_name, prompt) + ".json"), "w") as f:
+            json.dump({"model": self.model_name, "text": text}, f)
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        if not stream:
+            response = self.model.generate_content(prompt, **kwargs)
+            self._save(prompt, response.text)
+            return response
+
+        def chunks():
+            text = ""
+            for chunk in self.model.generate_content(prompt, stream=True, **kwargs):
+                text += chunk.text
+                yield chunk
+            self._save(prompt, text)
+        return chunks()
+
+
+class ReplayModel:
+    """GenerativeModel stand-in serving recorded replies, with injected faults."""
+
+    replay = True
+
+    def __init__(self, model_name, directory=None, faults=None):
+        self.model_name = model_name
+        self.directory = directory or recordings_dir("gemini")
+        self.faults = faults or Faults()
+        self._checks = None
+        self._lock = threading.Lock()
+
+    def _recorded_checks(self):
+        """Every recorded or imported check, by rule text (latest file wins)."""
+        with self._lock:
+            if self._checks is None:
+                self._checks = {}
+                for path in sorted(glob.glob(os.path.join(self.directory, "*.json"))):
+                    with open(path, "r") as f:
+                        text = json.load(f)["text"]
+                    try:
+                        checks = json.loads(text).get("checks", [])
+                    except (json.JSONDecodeError, AttributeError):
+                        continue
+                    self._checks.update((c.get("rule"), c) for c in checks)
+            return self._checks
+
+    def _reply_text(self, prompt):
+        path = os.path.join(self.directory, _key(self.model_name, prompt) + ".json")
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                return json.load(f)["text"]
+        recorded = self._recorded_checks()
+        checks = [
+            {**recorded[rule], "rule": rule} if rule in recorded
+            else {"rule": rule, "result": "FAIL", "reason": "No recorded answer for this rule."}
+            for rule in prompt_rules(prompt)
+        ]
+        return json.dumps({"checks": checks, "spelling_grammar": {"issues": []}})
+
+    def generate_content(self, prompt, stream=False, request_options=None, **kwargs):
+        timeout = (request_options or {}).get("timeout")
+        self.faults.apply("Gemini", timeout)
+        return model_reply(self._reply_text(prompt), stream)
+
+
+def make_model(live_factory, model_name):
+    """GenerativeModel for the selected backend; `live_factory()` builds the real one."""
+    name = backend_name("gemini")
+    if name == "replay":
+        return ReplayModel(model_name)
+    if name == "record":
+        return RecordingModel(live_factory(), model_name)
+    return live_factory()
+
+
+# --------------------------
+# Importing existing captures
+# --------------------------
+def import_capture(path):
+    """
+    Add an existing capture to the replay recordings: a stored Textract
+    response (.textract.npz or Textract JSON) or a saved validation record
+    (results.json). Returns the recording written.
+    """
+    if path.endswith(STORE_SUFFIX):
+        with load_textract(path) as stored:
+            response = stored.response()
+    else:
+        with open(path, "r") as f:
+            response = json.load(f)
+
+    if "Blocks" in response:
+        directory = recordings_dir("textract")
+        os.makedirs(directory, exist_ok=True)
+        return save_textract(response, _textract_path(directory, _key("import", os.path.abspath(path))))
+
+    from backend.validation_model import ValidationResult
+
+    validation = ValidationResult.from_dict(response["validation"])
+    directory = recordings_dir("gemini")
+    os.makedirs(directory, exist_ok=True)
+    out_path = os.path.join(directory, _key("import", os.path.abspath(path)) + ".json")
+    with open(out_path, "w") as f:
+        json.dump({"model": None, "text": json.dumps(validation.to_dict())}, f)
+    return out_path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "import":
+        print("usage: python -m backend.service_backends import CAPTURE [CAPTURE ...]")
+        sys.exit(2)
+    for capture in sys.argv[2:]:
+        print(f"{capture} -> {import_capture(capture)}")
@@ -0,0 +1,234 @@
+# backend/textract_store.py
+import json
+import os
+import sys
+import zlib
+import numpy as np
+
+# Format version written into every file; bump when the layout changes.
+STORE_VERSION = 1
+STORE_SUFFIX = ".textract.npz"
+
+# Geometry is stored as float32: Textract's normalized coordinates keep
+# about seven significant digits, far below a pixel on any page we render.
+GEOMETRY_DTYPE = np.float32
+
+
+def textract_path(image_path):
+    """Where the stored Textract response for an image lives."""
+    return os.path.splitext(image_path)[0] + STORE_SUFFIX
+
+
+def _pack_json(value):
+    return np.frombuffer(zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8")), np.uint8)
+
+
+def _unpack_json(array):
+    return json.loads(zlib.decompress(array.tobytes()).decode("utf-8"))
+
+
+def save_textract(response, path):
+    """
+    Write a Textract response as a compressed .npz: block types, ids, text
+    and confidences as arrays, bounding boxes as an (n, 4) float array,
+    polygons as flat points plus offsets, CHILD relationships as row
+    indices, the LINE text on its own, and everything else as compressed
+    JSON. load_textract() restores the response.
+    """
+    blocks = response.get("Blocks", [])
+    n = len(blocks)
+    block_types = sorted({block.get("BlockType", "") for block in blocks})
+    type_codes = {name: code for code, name in enumerate(block_types)}
+    row_of = {block.get("Id"): row for row, block in enumerate(blocks)}
+
+    bbox = np.full((n, 4), np.nan, GEOMETRY_DTYPE)
+    confidence = np.full(n, np.nan, GEOMETRY_DTYPE)
+    page = np.zeros(n, np.int32)
+    points, point_offsets = [], [0]
+    children, child_offsets = [], [0]
+    extras = []
+
+    for row, block in enumerate(blocks):
+        extra = {
+            key: value for key, value in block.items()
+            if key not in ("BlockType", "Id", "Text", "Confidence", "Geometry", "Relationships", "Page")
+        }
+        geometry = dict(block.get("Geometry") or {})
+        box = geometry.pop("BoundingBox", None)
+        if box:
+            bbox[row] = (box["Left"], box["Top"], box["Width"], box["Height"])
+        points.extend((p["X"], p["Y"]) for p in geometry.pop("Polygon", []))
+        point_offsets.append(len(points))
+        if geometry:
+            extra["Geometry"] = geometry
+        if "Confidence" in block:
+            confidence[row] = block["Confidence"]
+        if "Page" in block:
+            page[row] = block["Page"]
+
+        other_relationships = []
+        for relationship in block.get("Relationships", []):
+            ids = relationship.get("Ids", [])
+            if relationship.get("Type") == "CHILD" and all(i in row_of for i in ids):
+                children.extend(row_of[i] for i in ids)
+            else:
+                other_relationships.append(relationship)
+        child_offsets.append(len(children))
+        if other_relationships:
+            extra["Relationships"] = other_relationships
+        extras.append(extra)
+
+    line_rows = np.array(
+        [row for row, block in enumerate(blocks) if block.get("BlockType") == "LINE"], np.int32
+    )
+    text = [block.get("Text", "") for block in blocks]
+
+    meta = {key: value for key, value in response.items() if key != "Blocks"}
+    # Only record which blocks had a key the arrays cannot show as missing.
+    meta["_has"] = {
+        key: [row for row, block in enumerate(blocks) if key in block]
+        for key in ("Text", "Confidence", "Page", "Relationships")
+    }
+
+    np.savez_compressed(
+        path,
+        version=np.array(STORE_VERSION),
+        block_types=np.array(block_types, dtype=str),
+        type_code=np.array([type_codes[block.get("BlockType", "")] for block in blocks], np.uint8),
+        ids=np.array([block.get("Id", "") for block in blocks], dtype=str),
+        text=np.array(text, dtype=str),
+        confidence=confidence,
+        page=page,
+        bbox=bbox,
+        points=np.array(points, GEOMETRY_DTYPE).reshape(-1, 2),
+        point_offsets=np.array(point_offsets, np.int32),
+        children=np.array(children, np.int32),
+        child_offsets=np.array(child_offsets, np.int32),
+        line_rows=line_rows,
+        line_text=np.array([text[row] for row in line_rows], dtype=str),
+        extras=_pack_json(extras),
+        meta=_pack_json(meta),
+    )
+    return path
+
+
+class StoredTextract:
+    """
+    Lazy view of a stored Textract response. Each array is decompressed the
+    first time it is used, so reading the LINE text or the line geometry
+    never touches polygons, relationships or the JSON remainder.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._npz = np.load(path, allow_pickle=False)
+        version = int(self._npz["version"])
+        if version != STORE_VERSION:
+            raise ValueError(f"Unsupported Textract store version {version} in {path}")
+        self._arrays = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._npz.close()
+
+    def _get(self, name):
+        if name not in self._arrays:
+            self._arrays[name] = self._npz[name]
+        return self._arrays[name]
+
+    def line_text(self):
+        """Text of the LINE blocks, in Textract's reading order."""
+        return self._get("line_text").tolist()
+
+    def text(self):
+        """LINE text joined with newlines, as response_text() returns it."""
+        return "\n".join(self.line_text())
+
+    def line_geometry(self):
+        """(n_lines, 4) float array of LINE bounding boxes: left, top, width, height."""
+        return self._get("bbox")[self._get("line_rows")]
+
+    def geometry(self):
+        """Block type names per block and the (n_blocks, 4) bounding box array."""
+        types = self._get("block_types")[self._get("type_code")]
+        return types, self._get("bbox")
+
+    def lines(self, page=1):
+        """LINE blocks as layout_index.Line tuples."""
+        from backend.layout_index import Line
+
+        pages = self._get("page")[self._get("line_rows")]
+        return [
+            Line(text, int(p) or page, float(left), float(top), float(width), float(height))
+            for text, p, (left, top, width, height) in zip(self.line_text(), pages, self.line_geometry())
+        ]
+
+    def response(self):
+        """The full response as Textract returned it (geometry at float32 precision)."""
+        meta = _unpack_json(self._get("meta"))
+        has = {key: set(rows) for key, rows in meta.pop("_has").items()}
+        extras = _unpack_json(self._get("extras"))
+        types, bbox = self.geometry()
+        ids, text = self._get("ids"), self._get("text")
+        confidence, page = self._get("confidence"), self._get("page")
+        points, point_offsets = self._get("points"), self._get("point_offsets")
+        children, child_offsets = self._get("children"), self._get("child_offsets")
+
+        blocks = []
+        for row, extra in enumerate(extras):
+            block = {"BlockType": str(types[row])}
+            if row in has["Confidence"]:
+                block["Confidence"] = float(confidence[row])
+            if row in has["Text"]:
+                block["Text"] = str(text[row])
+            geometry = extra.pop("Geometry", {})
+            if not np.isnan(bbox[row, 0]):
+                left, top, width, height = bbox[row].tolist()
+                geometry["BoundingBox"] = {"Width": width, "Height": height, "Left": left, "Top": top}
+            polygon = points[point_offsets[row]:point_offsets[row + 1]]
+            if len(polygon):
+                geometry["Polygon"] = [{"X": x, "Y": y} for x, y in polygon.tolist()]
+            if geometry:
+                block["Geometry"] = geometry
+            if ids[row]:
+                block["Id"] = str(ids[row])
+            relationships = []
+            child_rows = children[child_offsets[row]:child_offsets[row + 1]]
+            if len(child_rows):
+                relationships.append({"Type": "CHILD", "Ids": [str(ids[c]) for c in child_rows]})
+            relationships.extend(extra.pop("Relationships", []))
+            if relationships or row in has["Relationships"]:
+                block["Relationships"] = relationships
+            if row in has["Page"]:
+                block["Page"] = int(page[row])
+            block.update(extra)
+            blocks.append(block)
+
+        return {**meta, "Blocks": blocks}
+
+
+def load_textract(path):
+    """Open a stored Textract response lazily; see StoredTextract."""
+    return StoredTextract(path)
+
+
+def convert_json(json_path, remove=False):
+    """Convert a Textract response saved as JSON to the compact store."""
+    with open(json_path, "r") as f:
+        response = json.load(f)
+    path = save_textract(response, os.path.splitext(json_path)[0] + STORE_SUFFIX)
+    if remove:
+        os.remove(json_path)
+    return path
+
+
+if __name__ == "__main__":
+    # python -m backend.textract_store bazooka/v1.json bazooka/v2.json
+    for json_path in sys.argv[1:]:
+        path = convert_json(json_path)
+        print(f"{json_path} ({os.path.getsize(json_path)} bytes) -> {path} ({os.path.getsize(path)} bytes)")
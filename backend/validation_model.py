@@ -0,0 +1,219 @@
+# backend/validation_model.py
+import json
+from dataclasses import dataclass, field
+from typing import Optional
+
+RESULT_VALUES = ("PASS", "FAIL")
+
+# Gemini response_schema for validate_text_with_llm; the model is constrained
+# to emit exactly this JSON, so replies parse without fence-hunting.
+RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "checks": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "rule": {"type": "STRING"},
+                    "result": {"type": "STRING", "format": "enum", "enum": list(RESULT_VALUES)},
+                    "reason": {"type": "STRING"},
+                },
+                "required": ["rule", "result", "reason"],
+            },
+        },
+        "spelling_grammar": {
+            "type": "OBJECT",
+            "properties": {
+                "issues": {
+                    "type": "ARRAY",
+                    "items": {
+                        "type": "OBJECT",
+                        "properties": {
+                            "ocr_text": {"type": "STRING"},
+                            "correct_text": {"type": "STRING"},
+                        },
+                        "required": ["ocr_text", "correct_text"],
+                    },
+                },
+            },
+            "required": ["issues"],
+        },
+    },
+    "required": ["checks", "spelling_grammar"],
+}
+
+
+@dataclass(slots=True)
+class Check:
+    rule: str
+    result: str
+    reason: str = ""
+
+    @property
+    def passed(self):
+        return self.result == "PASS"
+
+    def to_dict(self):
+        return {"rule": self.rule, "result": self.result, "reason": self.reason}
+
+    @classmethod
+    def from_dict(cls, data):
+        result = str(data.get("result", "")).strip().upper()
+        return cls(
+            rule=str(data.get("rule", "")),
+            result=result if result in RESULT_VALUES else "FAIL",
+            reason=str(data.get("reason", "")),
+        )
+
+
+@dataclass(slots=True)
+class SpellingIssue:
+    ocr_text: str
+    correct_text: str
+
+    def to_dict(self):
+        return {"ocr_text": self.ocr_text, "correct_text": self.correct_text}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(ocr_text=str(data.get("ocr_text", "")), correct_text=str(data.get("correct_text", "")))
+
+
+@dataclass(slots=True)
+class ValidationResult:
+    """
+    Parsed validation report. Built once from the model reply (or a stored
+    record) and passed as-is to rendering, persistence and history views.
+    `error` is set when the reply could not be read; checks may then be partial.
+    `warnings` note things the reader should know but that do not make the
+    report wrong, such as OCR text cut to fit the prompt.
+    """
+    checks: list = field(default_factory=list)
+    issues: list = field(default_factory=list)
+    prompt_stats: dict = field(default_factory=dict)
+    error: Optional[str] = None
+    warnings: list = field(default_factory=list)
+
+    @property
+    def passed(self):
+        return [c for c in self.checks if c.result == "PASS"]
+
+    @property
+    def failed(self):
+        return [c for c in self.checks if c.result == "FAIL"]
+
+    def to_dict(self):
+        data = {
+            "checks": [c.to_dict() for c in self.checks],
+            "spelling_grammar": {"issues": [i.to_dict() for i in self.issues]},
+        }
+        if self.prompt_stats:
+            data["prompt_stats"] = self.prompt_stats
+        if self.error:
+            data["error"] = self.error
+        if self.warnings:
+            data["warnings"] = list(self.warnings)
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Build from a stored record. Older records hold the raw model reply
+        as a string; those are parsed here, once, on load.
+        """
+        if isinstance(data, str):
+            try:
+                data = parse_model_json(data)
+            except ValueError as e:
+                return cls(error=str(e))
+        return cls(
+            checks=[Check.from_dict(c) for c in data.get("checks", [])],
+            issues=[SpellingIssue.from_dict(i) for i in data.get("spelling_grammar", {}).get("issues", [])],
+            prompt_stats=data.get("prompt_stats", {}),
+            error=data.get("error"),
+            warnings=list(data.get("warnings", [])),
+        )
+
+
+def parse_model_json(text):
+    """
+    Parse a model reply into a dict, accepting a ```json fence as older,
+    unconstrained replies had. Raises ValueError when no JSON object can be read.
+    """
+    start = text.find("```json")
+    if start != -1:
+        start += len("```json")
+        end = text.find("```", start)
+        text = text[start:end if end != -1 else None]
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Model reply is not valid JSON: {e}") from e
+    if not isinstance(data, dict):
+        raise ValueError("Model reply is not a JSON object")
+    return data
+
+
+class CheckStreamParser:
+    """
+    Incremental reader for a streamed model reply. feed() text chunks as they
+    arrive; each call returns the check objects of the "checks" array that
+    were completed by that chunk, already parsed.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._in_checks = False
+        self._done = False
+        self._depth = 0
+        self._start = None
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk):
+        self.text += chunk
+        completed = []
+        if self._done:
+            return completed
+
+        if not self._in_checks:
+            key = self.text.find('"checks"')
+            bracket = self.text.find("[", key) if key != -1 else -1
+            if bracket == -1:
+                return completed
+            self._in_checks = True
+            self._pos = bracket + 1
+
+        text = self.text
+        i = self._pos
+        while i < len(text):
+            ch = text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                if self._depth == 0:
+                    self._start = i
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        completed.append(json.loads(text[self._start:i + 1]))
+                    except json.JSONDecodeError:
+                        pass
+            elif ch == "]" and self._depth == 0:
+                self._done = True
+                i += 1
+                break
+            i += 1
+        self._pos = i
+        return completed
@@ -0,0 +1,270 @@
+# backend/version_diff.py
+import argparse
+import difflib
+import re
+import cv2
+import numpy as np
+from backend.image_detecter import non_max_suppression
+from backend.llm_service import group_rules, match_checks, validate_text_with_llm
+from backend.pipeline import analyze_document, detect_page, prompt_notes, run_pipeline
+from backend.rule_engine import (
+    AGES_PATTERN,
+    BAZOOKA_MENTION_PATTERN,
+    COUNTRY_OF_ORIGIN_PATTERN,
+    GUM_PATTERN,
+    KOSHER_MARK_PATTERN,
+    KOSHER_TEXT_PATTERN,
+    LEGAL_IP_PATTERN,
+    MANUFACTURER_PATTERN,
+    NET_WEIGHT_PATTERN,
+    UNIT_COUNT_PATTERN,
+    evaluate_rules,
+)
+from backend.validation_model import Check, ValidationResult
+
+# Pages are compared in square tiles; a tile counts as changed when more
+# than CHANGED_TILE_FRACTION of its pixels differ by over PIXEL_DELTA grey
+# levels (well above re-rasterization noise).
+TILE_SIZE = 256
+PIXEL_DELTA = 40
+CHANGED_TILE_FRACTION = 0.001
+
+# A line whose text is unchanged but whose top edge moved further than
+# this (normalized page units) counts as changed, for positional rules.
+LINE_MOVE_TOLERANCE = 0.01
+
+NUTRITION_PATTERN = re.compile(
+    r"\bNUTRITION\b|\bSERVINGS?\b|\bCALORIES\b|\bFAT\b|\bSODIUM\b|\bCARBOHYDRATE|\bSUGARS?\b|\bPROTEIN\b"
+    r"|\bDAILY VALUE|\bINGREDIENTS?\b",
+    re.IGNORECASE,
+)
+INGREDIENTS_PATTERN = re.compile(r"\bINGREDIENTS?\b|\bCONTAINS\b|\bALLERG", re.IGNORECASE)
+GELATIN_TEXT_PATTERN = re.compile(r"\bGE[L1I]AT", re.IGNORECASE)
+
+# (pattern over the rule text, patterns over OCR lines that can change its
+# outcome). A rule is re-checked only when a changed line matches one of
+# its patterns; rules not listed here are re-checked on any text change.
+RULE_TOPICS = [
+    (re.compile(r"'Ages 4\+'", re.IGNORECASE), (AGES_PATTERN, BAZOOKA_MENTION_PATTERN, GUM_PATTERN, MANUFACTURER_PATTERN)),
+    (re.compile(r"Net Weight", re.IGNORECASE), (NET_WEIGHT_PATTERN,)),
+    (re.compile(r"unit count", re.IGNORECASE), (UNIT_COUNT_PATTERN,)),
+    (re.compile(r"manufacturer/distributor information", re.IGNORECASE), (MANUFACTURER_PATTERN, LEGAL_IP_PATTERN)),
+    (re.compile(r"NFP contains ingredients", re.IGNORECASE), (INGREDIENTS_PATTERN, NUTRITION_PATTERN)),
+    (re.compile(r"NFP", re.IGNORECASE), (NUTRITION_PATTERN,)),
+    (re.compile(r"country of origin", re.IGNORECASE), (COUNTRY_OF_ORIGIN_PATTERN, MANUFACTURER_PATTERN)),
+    (re.compile(r"Gelatin", re.IGNORECASE), (
+        GELATIN_TEXT_PATTERN, KOSHER_TEXT_PATTERN, KOSHER_MARK_PATTERN, INGREDIENTS_PATTERN,
+    )),
+]
+
+
+def _line_key(text):
+    return re.sub(r"[^a-z0-9]", "", text.lower())
+
+
+def diff_lines(old_lines, new_lines):
+    """
+    Align two revisions' OCR lines (layout_index.Line tuples, in reading
+    order) on their normalized text.
+    Returns {"added", "removed", "moved", "unchanged"}: lists of Lines new
+    in the revision, gone from it, and present in both but moved (the new
+    Line), plus the count of lines that are the same.
+    """
+    matcher = difflib.SequenceMatcher(
+        None, [_line_key(l.text) for l in old_lines], [_line_key(l.text) for l in new_lines], autojunk=False
+    )
+    diff = {"added": [], "removed": [], "moved": [], "unchanged": 0}
+    for op, i1, i2, j1, j2 in matcher.get_opcodes():
+        if op == "equal":
+            for old, new in zip(old_lines[i1:i2], new_lines[j1:j2]):
+                if old.page != new.page or abs(old.top - new.top) > LINE_MOVE_TOLERANCE:
+                    diff["moved"].append(new)
+                else:
+                    diff["unchanged"] += 1
+        else:
+            diff["removed"].extend(old_lines[i1:i2])
+            diff["added"].extend(new_lines[j1:j2])
+    return diff
+
+
+def changed_text(diff):
+    """Texts of every added, removed or moved line."""
+    return [line.text for key in ("added", "removed", "moved") for line in diff[key]]
+
+
+def affected_rules(rules, diff):
+    """Rules whose outcome the text changes in `diff` could alter, in rule order."""
+    texts = changed_text(diff)
+    if not texts:
+        return []
+    affected = []
+    for rule in rules:
+        topics = next((patterns for pattern, patterns in RULE_TOPICS if pattern.search(rule)), None)
+        if topics is None or any(p.search(text) for p in topics for text in texts):
+            affected.append(rule)
+    return affected
+
+
+def changed_tiles(old_image, new_image, tile_size=TILE_SIZE):
+    """
+    Compare two page images of the same size and return the changed areas
+    as (x, y, w, h) rectangles, horizontally adjacent changed tiles merged.
+    Returns None when the sizes differ and tiles cannot be compared.
+    """
+    old = cv2.imread(old_image, cv2.IMREAD_GRAYSCALE)
+    new = cv2.imread(new_image, cv2.IMREAD_GRAYSCALE)
+    if old is None or new is None:
+        raise ValueError(f"Image not found: {old_image if old is None else new_image}")
+    if old.shape != new.shape:
+        return None
+
+    H, W = new.shape
+    changed = (cv2.absdiff(old, new) > PIXEL_DELTA).astype(np.float32)
+    rows, cols = -(-H // tile_size), -(-W // tile_size)
+    padded = np.zeros((rows * tile_size, cols * tile_size), np.float32)
+    padded[:H, :W] = changed
+    fraction = padded.reshape(rows, tile_size, cols, tile_size).mean(axis=(1, 3))
+
+    rects = []
+    for row, col_mask in enumerate(fraction > CHANGED_TILE_FRACTION):
+        col = 0
+        while col < cols:
+            if not col_mask[col]:
+                col += 1
+                continue
+            start = col
+            while col < cols and col_mask[col]:
+                col += 1
+            x, y = start * tile_size, row * tile_size
+            rects.append((x, y, min(W, col * tile_size) - x, min(H, y + tile_size) - y))
+    return rects
+
+
+def _overlaps(symbol, rect):
+    x, y = symbol["location"]
+    w, h = symbol["size"]
+    rx, ry, rw, rh = rect
+    return x < rx + rw and rx < x + w and y < ry + rh and ry < y + h
+
+
+def analyze_revision(file_path, previous, pages_dir="temp_pages", ocr_kwargs=None, detect_kwargs=None):
+    """
+    analyze_document() for a new revision of the artwork in `previous` (an
+    analyze_document() result), re-running symbol detection only inside the
+    image tiles that changed. Previous symbols outside those tiles are kept.
+    Pages that are new or changed size are searched in full.
+    Adds "revision": per-page {"page", "changed_regions", "full_detection"}.
+    """
+    detect_kwargs = {**(detect_kwargs or {}), "visualize": False}
+    revision = []
+
+    def detector(image_paths):
+        symbols = []
+        for page, image_path in enumerate(image_paths, start=1):
+            regions = None
+            if page <= len(previous["image_paths"]):
+                regions = changed_tiles(previous["image_paths"][page - 1], image_path)
+            revision.append({
+                "page": page,
+                "changed_regions": len(regions) if regions is not None else None,
+                "full_detection": regions is None,
+            })
+            if regions is None:
+                symbols.extend(detect_page(image_path, page, **detect_kwargs))
+                continue
+
+            kept = [
+                sym for sym in previous["symbols"]
+                if sym.get("page", 1) == page and not any(_overlaps(sym, rect) for rect in regions)
+            ]
+            found = detect_page(image_path, page, regions=regions, **detect_kwargs) if regions else []
+            # A symbol next to a changed tile can be found again; keep one.
+            symbols.extend(non_max_suppression(kept + found))
+        return symbols
+
+    analysis = analyze_document(file_path, pages_dir, ocr_kwargs, detector=detector)
+    analysis["revision"] = revision
+    return analysis
+
+
+def revalidate(previous, current, prior_result, check_group="All", **validation_kwargs):
+    """
+    Validate a revision, asking the model only about rules its text changes
+    could affect; other model-decided rules reuse `prior_result` (the
+    previous revision's ValidationResult). Rules the local engine decides
+    are always re-evaluated; with no text or symbol change the model is not
+    called at all. A prior result with an error (a model request that
+    timed out or failed) is not reused: every rule is asked again.
+    Returns (ValidationResult, diff) where diff is diff_lines() plus
+    "affected_rules" and "symbols_changed".
+    """
+    diff = diff_lines(previous["layout"].lines(), current["layout"].lines())
+    rules = group_rules(check_group)
+    affected = affected_rules(rules, diff)
+
+    # A symbol appearing or disappearing changes the Kosher/Gelatin answer.
+    symbols_changed = {s["symbol"] for s in previous["symbols"]} != {s["symbol"] for s in current["symbols"]}
+    if symbols_changed:
+        affected.extend(r for r in rules if re.search(r"Kosher", r, re.IGNORECASE) and r not in affected)
+    diff["affected_rules"] = affected
+    diff["symbols_changed"] = symbols_changed
+
+    if prior_result.error:
+        result = validate_text_with_llm(
+            current["ocr_text"], check_group, symbols=current["symbols"], layout=current["layout"],
+            notes=prompt_notes(current), **validation_kwargs
+        )
+        return result, diff
+
+    if not affected and not changed_text(diff):
+        # Same text and symbols: every answer, spelling included, still
+        # holds; only rules the engine decides locally are re-evaluated.
+        resolved, _ = evaluate_rules(rules, current["ocr_text"], current["symbols"], current["layout"])
+        checks = [Check.from_dict(resolved[c.rule]) if c.rule in resolved else c for c in prior_result.checks]
+        result = ValidationResult(
+            checks, list(prior_result.issues), dict(prior_result.prompt_stats), warnings=list(prior_result.warnings)
+        )
+        return result, diff
+
+    # Keyed on the requested rule text, whatever wording the model echoed.
+    prior_checks, _ = match_checks(rules, prior_result.checks, by_position=False)
+    prior_checks = {rule: check for rule, check in prior_checks.items() if rule not in affected}
+    result = validate_text_with_llm(
+        current["ocr_text"],
+        check_group,
+        symbols=current["symbols"],
+        layout=current["layout"],
+        prior_checks=prior_checks,
+        notes=prompt_notes(current),
+        **validation_kwargs,
+    )
+    return result, diff
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-validate a new artwork revision against the previous one.")
+    parser.add_argument("previous", help="previous revision (PDF or image)")
+    parser.add_argument("current", help="new revision (PDF or image)")
+    parser.add_argument("--group", default="All", choices=["Front", "Back", "All"])
+    parser.add_argument("--templates", default="bazooka/symbols/", help="Kosher symbol template folder")
+    args = parser.parse_args(argv)
+
+    detect_kwargs = {"templates_folder": args.templates, "visualize": False}
+    previous = run_pipeline(args.previous, args.group, pages_dir="diff_pages/previous", detect_kwargs=detect_kwargs)
+    current = analyze_revision(args.current, previous, "diff_pages/current", detect_kwargs=detect_kwargs)
+    result, diff = revalidate(previous, current, previous["validation"], args.group)
+
+    print(f"Lines: {len(diff['added'])} added, {len(diff['removed'])} removed, "
+          f"{len(diff['moved'])} moved, {diff['unchanged']} unchanged")
+    for page in current["revision"]:
+        regions = "full page" if page["full_detection"] else f"{page['changed_regions']} changed region(s)"
+        print(f"Page {page['page']}: symbol detection on {regions}")
+    print(f"Rules re-checked: {len(diff['affected_rules'])} of {len(group_rules(args.group))}")
+    for check in result.checks:
+        print(f"  {check.result}  {check.rule}")
+    if result.error:
+        print(f"Error: {result.error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+# batch_validate.py
+"""
+Validate a folder of packaging artwork without the Streamlit app.
+
+    python batch_validate.py ARTWORK_DIR --out results.jsonl --group All --jobs 4
+
+Each file runs rasterize -> OCR + symbol detection -> validation in a worker
+process. One JSON record per file is appended to --out as soon as it
+finishes, so the output file is also the checkpoint: re-running the same
+command skips files that already have a successful record and retries the
+ones that failed.
+
+For load tests without network or quota, replay recorded service replies:
+
+    python batch_validate.py ARTWORK_DIR --backend replay --latency 0.5-2 --error-rate 0.02 --no-cache
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+ARTWORK_EXTENSIONS = (".pdf", ".png", ".jpg", ".jpeg")
+
+# Per-worker settings, filled in by _init_worker in each pool process.
+_WORKER = {}
+
+
+def iter_artwork(folder, recursive=True):
+    """Artwork files under `folder`, sorted so runs process files in a stable order."""
+    found = []
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        if not recursive:
+            dirs[:] = []
+        for name in files:
+            if name.lower().endswith(ARTWORK_EXTENSIONS):
+                found.append(os.path.join(root, name))
+    return sorted(found)
+
+
+def record_error(record):
+    """
+    Why a record failed, or None: the pipeline raised, or a model request
+    timed out or failed and left placeholder checks in the validation.
+    """
+    return record.get("error") or record.get("validation", {}).get("error")
+
+
+def load_checkpoint(out_path):
+    """
+    Keys ((relative path, check group)) of files with a successful record in
+    an existing output file. A truncated last line from an interrupted run is
+    ignored, so that file is simply processed again.
+    """
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if not record_error(record):
+                done.add((record["path"], record["check_group"]))
+    return done
+
+
+def _init_worker(options):
+    # Imported here so the parent process never loads the SDKs it does not use.
+    from backend import ocr_service
+    from backend.rate_limiter import TokenBucket
+
+    # The Textract quota is shared by every worker process.
+    ocr_service.TEXTRACT_RATE_LIMITER = TokenBucket(ocr_service.TEXTRACT_TPS / options["jobs"])
+    _WORKER.update(options)
+
+
+def _jsonable(value):
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+def validate_file(path):
+    """Worker: run the full pipeline on one file and return its JSON record."""
+    from backend.metrics import Trace
+    from backend.pipeline import run_pipeline
+
+    relative = os.path.relpath(path, _WORKER["root"])
+    record = {"path": relative, "file": os.path.basename(path), "check_group": _WORKER["group"]}
+    pages_dir = os.path.join(_WORKER["pages_dir"], hashlib.sha1(relative.encode("utf-8")).hexdigest()[:16])
+    trace = Trace(relative)
+    try:
+        with trace.active():
+            result = run_pipeline(
+                path,
+                _WORKER["group"],
+                pages_dir=pages_dir,
+                ocr_kwargs={"use_cache": _WORKER["use_cache"]},
+                use_cache=_WORKER["use_cache"],
+                detect_kwargs={
+                    "templates_folder": _WORKER["templates"],
+                    "visualize": False,
+                    "mode": _WORKER["detect_mode"],
+                    "workers": _WORKER["detect_workers"],
+                },
+            )
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        return record
+    finally:
+        if _WORKER["trace_dir"]:
+            name = hashlib.sha1(relative.encode("utf-8")).hexdigest()[:16]
+            trace.write(os.path.join(_WORKER["trace_dir"], f"{name}.trace.json"))
+
+    record.update({
+        "pages": len(result["image_paths"]),
+        "symbols": result["symbols"],
+        "validation": result["validation"].to_dict(),
+        "timings": result["timings"],
+        "counters": trace.counters,
+    })
+    return record
+
+
+def run_batch(paths, out_path, options, jobs):
+    """
+    Validate `paths` on `jobs` worker processes, keeping at most 2 * jobs
+    files in flight, and append each record to `out_path` as it completes.
+    Returns (records written, failures, stage time totals).
+    """
+    written = failed = 0
+    stage_totals = {}
+    pending = set()
+    queue = iter(paths)
+
+    with open(out_path, "a", encoding="utf-8") as out, \
+            ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(options,)) as executor:
+        while True:
+            for path in queue:
+                pending.add(executor.submit(validate_file, path))
+                if len(pending) >= 2 * jobs:
+                    break
+            if not pending:
+                break
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                record = future.result()
+                out.write(json.dumps(record, default=_jsonable) + "\n")
+                out.flush()
+                written += 1
+                error = record_error(record)
+                if error:
+                    failed += 1
+                    print(f"FAIL  {record['path']}: {error}", file=sys.stderr)
+                else:
+                    failed_checks = sum(1 for c in record["validation"]["checks"] if c["result"] != "PASS")
+                    print(f"done  {record['path']} ({failed_checks} failed checks)")
+                for stage, seconds in record.get("timings", {}).items():
+                    stage_totals[stage] = stage_totals.get(stage, 0.0) + seconds
+    return written, failed, stage_totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validate a folder of packaging artwork.")
+    parser.add_argument("folder", help="folder of PDFs/images to validate")
+    parser.add_argument("--out", default="batch_results.jsonl", help="JSONL output, also used as the checkpoint")
+    parser.add_argument("--group", default="All", choices=["Front", "Back", "All"], help="check group")
+    parser.add_argument("--jobs", type=int, default=max(1, min(4, os.cpu_count() or 1)),
+                        help="worker processes (files validated at once)")
+    parser.add_argument("--templates", default="bazooka/symbols/", help="Kosher symbol template folder")
+    parser.add_argument("--detect-mode", default="pyramid", choices=["full", "pyramid"])
+    parser.add_argument("--pages-dir", default="batch_pages", help="where rasterized PDF pages are written")
+    parser.add_argument("--no-recursive", action="store_true", help="only look at the top-level folder")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start over")
+    parser.add_argument("--trace-dir", help="write a JSON trace per file here (chrome://tracing, Perfetto)")
+    parser.add_argument("--backend", choices=["live", "record", "replay"],
+                        help="Textract/Gemini backend (default: SERVICE_BACKEND or live)")
+    parser.add_argument("--latency", help="replay latency per call in seconds, e.g. 0.8 or 0.2-1.5")
+    parser.add_argument("--error-rate", type=float, help="fraction of replayed calls that fail")
+    parser.add_argument("--seed", help="seed for replay latency and errors")
+    parser.add_argument("--no-cache", action="store_true", help="bypass the OCR and LLM caches")
+    args = parser.parse_args(argv)
+
+    if args.restart and os.path.exists(args.out):
+        os.remove(args.out)
+    if args.trace_dir:
+        os.makedirs(args.trace_dir, exist_ok=True)
+    # Worker processes read the backend settings from their environment.
+    for name, value in (("SERVICE_BACKEND", args.backend), ("REPLAY_LATENCY", args.latency),
+                        ("REPLAY_ERROR_RATE", args.error_rate), ("REPLAY_SEED", args.seed)):
+        if value is not None:
+            os.environ[name] = str(value)
+
+    paths = iter_artwork(args.folder, recursive=not args.no_recursive)
+    done = load_checkpoint(args.out)
+    todo = [p for p in paths if (os.path.relpath(p, args.folder), args.group) not in done]
+    skipped = len(paths) - len(todo)
+    print(f"{len(paths)} file(s) found, {skipped} already validated, {len(todo)} to run on {args.jobs} worker(s)")
+
+    options = {
+        "root": args.folder,
+        "group": args.group,
+        "templates": args.templates,
+        "detect_mode": args.detect_mode,
+        "pages_dir": args.pages_dir,
+        "jobs": args.jobs,
+        "trace_dir": args.trace_dir,
+        "use_cache": not args.no_cache,
+        # Split the cores between processes instead of each one taking them all.
+        "detect_workers": max(1, (os.cpu_count() or 1) // args.jobs),
+    }
+    start = time.perf_counter()
+    written, failed, stage_totals = run_batch(todo, args.out, options, args.jobs) if todo else (0, 0, {})
+    elapsed = time.perf_counter() - start
+
+    print()
+    print(f"Validated {written - failed} file(s), {failed} failed, {skipped} skipped in {elapsed:.1f}s")
+    if written:
+        print(f"Throughput: {written / elapsed * 60:.1f} files/min ({elapsed / written:.2f}s per file wall time)")
+        stages = ", ".join(
+            f"{stage} {seconds / written:.2f}s" for stage, seconds in stage_totals.items() if stage != "total"
+        )
+        if stages:
+            print(f"Mean stage time per file: {stages}")
+    print(f"Results: {args.out}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,8 @@
-import json
 import pprint
-import re
 import boto3
 from pdf2image import convert_from_path
-from textractor.entities.document import Document
+from backend.prompt_compaction import normalize_newlines
+from backend.textract_store import load_textract, save_textract
 # from textractor.utils.textract_response_parser import TextractResponseParser
 
 def pdf_2_image():
@@ -18,35 +17,24 @@ def pdf_2_image():
         image_bytes = document.read()
     response = textract.detect_document_text(Document={'Bytes': image_bytes})
 
-    with open('bazooka/v1.json', 'w') as f1:
-        json.dump(response,f1)
+    save_textract(response, 'bazooka/v1.textract.npz')
 
     pprint.pprint(response)
 
     with open("bazooka/page_v2.png", "rb") as document:
         image_bytes = document.read()
     response = textract.detect_document_text(Document={'Bytes': image_bytes})
-    with open('bazooka/v2.json', 'w') as f2:
-        json.dump(response,f2)
+    save_textract(response, 'bazooka/v2.textract.npz')
 
     pprint.pprint(response)
 # pdf_2_image()
 
 def load_object():
-    with open("D:/Bazooka/bazooka/v1.json", "r") as f:
-        json_data = f.read()
-    document = Document.open("D:/Bazooka/bazooka/v1.json")
-    text = document.text
+    with load_textract("D:/Bazooka/bazooka/v1.textract.npz") as document:
+        text = document.text()
     # text = document.text.replace("\n",r"\n")
     return text
 
-def normalize_newlines(text: str) -> str:
-    # Collapse 3+ newlines into 2 (paragraph separation)
-    text = re.sub(r'\n{3,}', '\n', text)
-    # Collapse multiple spaces/tabs
-    text = re.sub(r'[ \t]+', ' ', text)
-    return text.strip()
-
 raw_text = load_object()
 print(raw_text)
 # normalized_text = normalize_newlines(raw_text)
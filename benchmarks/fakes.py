@@ -0,0 +1,83 @@
+# benchmarks/fakes.py
+"""
+Recorded-response stand-ins for Textract and Gemini, so benchmarks measure
+our own code without network calls or credentials.
+Textract replies are replayed from benchmarks/recordings/ when a recording
+exists (see run_benchmarks --record); otherwise a fixed synthetic response
+with the same shape is used. Gemini replies are synthesized from the rules
+in the prompt, so every shard gets an answer for each of its rules.
+"""
+import json
+import os
+from backend.service_backends import model_reply, prompt_rules
+
+RECORDINGS_DIR = os.path.join(os.path.dirname(__file__), "recordings")
+
+# Synthetic panel copy for unrecorded images: (text, top) per LINE block.
+SYNTHETIC_LINES = [
+    ("BAZOOKA", 0.05),
+    ("RING POP", 0.12),
+    ("NUTRITION FACTS", 0.30),
+    ("Serving Size 1 Ring Pop (10g)", 0.34),
+    ("Calories 40", 0.38),
+    ("INGREDIENTS: SUGAR, CORN SYRUP, CITRIC ACID, ARTIFICIAL FLAVOR", 0.45),
+    ("©2025 The Bazooka Companies, Inc.", 0.70),
+    ("Distributed by The Bazooka Companies, Inc. New York, NY 10004", 0.74),
+    ("Made in USA", 0.78),
+    ("Ages 4+", 0.90),
+    ("NET WT 0.35 OZ (10g)", 0.94),
+    ("1 RING POP", 0.97),
+]
+
+
+def recording_path(kind, name):
+    return os.path.join(RECORDINGS_DIR, f"{kind}_{name}.json")
+
+
+def synthetic_textract_response(lines=SYNTHETIC_LINES):
+    blocks = [{"BlockType": "PAGE", "Id": "page-1", "Geometry": {"BoundingBox": {
+        "Width": 1.0, "Height": 1.0, "Left": 0.0, "Top": 0.0}}}]
+    for i, (text, top) in enumerate(lines):
+        box = {"Width": min(0.9, 0.012 * len(text)), "Height": 0.02, "Left": 0.05, "Top": top}
+        blocks.append({"BlockType": "LINE", "Id": f"line-{i}", "Text": text, "Confidence": 99.0,
+                       "Geometry": {"BoundingBox": box}})
+    return {"DocumentMetadata": {"Pages": 1}, "Blocks": blocks}
+
+
+class FakeTextract:
+    """
+    detect_document_text() replaying recordings keyed by `name` (the image's
+    base name), or the synthetic response.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+
+    def detect_document_text(self, Document):
+        self.calls += 1
+        path = recording_path("textract", self.name)
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                return json.load(f)
+        return synthetic_textract_response()
+
+
+class FakeGenerativeModel:
+    """GenerativeModel stand-in answering PASS for every rule listed in the prompt."""
+
+    def __init__(self, *args, **kwargs):
+        self.calls = 0
+
+    def _reply(self, prompt):
+        return json.dumps({
+            "checks": [
+                {"rule": rule, "result": "PASS", "reason": "Synthetic benchmark reply."} for rule in prompt_rules(prompt)
+            ],
+            "spelling_grammar": {"issues": []},
+        })
+
+    def generate_content(self, prompt, stream=False, request_options=None):
+        self.calls += 1
+        # Streamed replies come in small chunks, as the live API sends them.
+        return model_reply(self._reply(prompt), stream)
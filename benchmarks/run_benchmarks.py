@@ -0,0 +1,300 @@
+# benchmarks/run_benchmarks.py
+"""
+Offline benchmarks over the bundled bazooka/ samples.
+
+    python -m benchmarks.run_benchmarks                  # run and compare to baseline.json
+    python -m benchmarks.run_benchmarks --check          # exit 1 on a regression
+    python -m benchmarks.run_benchmarks --update-baseline
+    python -m benchmarks.run_benchmarks --record         # capture live Textract replies
+
+Each case runs in its own subprocess, so its peak RSS is its own. Setup
+(imports, template loading, fixtures) is excluded from the wall time.
+Textract and Gemini are replaced by benchmarks.fakes, so no credentials
+or network are needed. The candidate counts are deterministic and must
+match the baseline exactly. Wall time and RSS are compared within the
+tolerances below. Baselines are machine-specific: refresh them on the
+machine used for review when it changes.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLES_DIR = os.path.join(ROOT, "bazooka")
+SYMBOLS_DIR = os.path.join(SAMPLES_DIR, "symbols")
+PAGE_V2 = os.path.join(SAMPLES_DIR, "page_v2.png")
+RINGPOP = os.path.join(SAMPLES_DIR, "Sample 1 Front- Blue RingPop.jpg")
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Allowed slowdown / memory growth over the baseline before a case is
+# reported as a regression.
+WALL_TOLERANCE = 0.25
+RSS_TOLERANCE = 0.15
+
+CASES = {}
+
+
+class Skip(Exception):
+    """Raised by a case's setup when it cannot run here (e.g. no poppler)."""
+
+
+def case(name):
+    """Register a case: a setup function returning the callable to time."""
+    def register(setup):
+        CASES[name] = setup
+        return setup
+    return register
+
+
+def _detect_case(image_path, **detect_kwargs):
+    from backend.image_detecter import detect_kosher_symbol, get_template_library
+
+    get_template_library(SYMBOLS_DIR)
+
+    def run():
+        stats = {}
+        detect_kosher_symbol(image_path, SYMBOLS_DIR, visualize=False, stats=stats, **detect_kwargs)
+        return stats
+    return run
+
+
+@case("detect_full_ringpop")
+def detect_full_ringpop(scratch):
+    return _detect_case(RINGPOP)
+
+
+@case("detect_full_page_v2")
+def detect_full_page_v2(scratch):
+    return _detect_case(PAGE_V2)
+
+
+@case("detect_pyramid_page_v2")
+def detect_pyramid_page_v2(scratch):
+    return _detect_case(PAGE_V2, mode="pyramid")
+
+
+@case("nms_20k")
+def nms_20k(scratch):
+    import numpy as np
+    from backend.image_detecter import non_max_suppression
+
+    rng = np.random.default_rng(0)
+    xy = rng.integers(0, 4000, size=(20000, 2))
+    sizes = rng.integers(10, 80, size=20000)
+    scores = rng.random(20000)
+    detections = [
+        {"location": (int(x), int(y)), "size": (int(s), int(s)), "confidence": float(c)}
+        for (x, y), s, c in zip(xy, sizes, scores)
+    ]
+
+    def run():
+        kept = non_max_suppression(detections)
+        return {"candidates": len(detections), "detections": len(kept)}
+    return run
+
+
+@case("pdf_to_image")
+def pdf_to_image_case(scratch):
+    from PIL import Image
+    from backend.ocr_service import pdf_to_image
+
+    if shutil.which("pdftoppm") is None:
+        raise Skip("poppler (pdftoppm) is not installed")
+    pdf_path = os.path.join(scratch, "page_v2.pdf")
+    Image.open(PAGE_V2).convert("RGB").save(pdf_path, resolution=300)
+
+    def run():
+        pdf_to_image(pdf_path, os.path.join(scratch, "page.png"), dpi=300)
+        return {"pages": 1}
+    return run
+
+
+@case("end_to_end_page_v2")
+def end_to_end_page_v2(scratch):
+    from benchmarks.fakes import FakeGenerativeModel, FakeTextract
+    from backend import llm_service
+    from backend.image_detecter import get_template_library
+    from backend.pipeline import run_pipeline
+
+    llm_service.genai.GenerativeModel = FakeGenerativeModel
+    llm_service._MODELS.clear()
+    get_template_library(SYMBOLS_DIR)
+    # detect_document stores the Textract reply beside the image.
+    image_path = os.path.join(scratch, "page_v2.png")
+    shutil.copy(PAGE_V2, image_path)
+    textract = FakeTextract("page_v2")
+
+    def run():
+        result = run_pipeline(
+            image_path,
+            "All",
+            pages_dir=os.path.join(scratch, "pages"),
+            ocr_kwargs={"client": textract, "use_cache": False},
+            detect_kwargs={"templates_folder": SYMBOLS_DIR, "visualize": False},
+            use_cache=False,
+        )
+        return {
+            "lines": len(result["layout"].lines()),
+            "symbols": len(result["symbols"]),
+            "checks": len(result["validation"].checks),
+            "stages": {stage: round(seconds, 3) for stage, seconds in result["timings"].items()},
+        }
+    return run
+
+
+def run_child(name):
+    """Run one case in this process and print its measurements as JSON."""
+    scratch = tempfile.mkdtemp(prefix="bench_")
+    # Keep the OCR/LLM disk caches out of the working tree and cold.
+    os.environ["OCR_CACHE_DIR"] = os.path.join(scratch, "ocr_cache")
+    os.environ["LLM_CACHE_DIR"] = os.path.join(scratch, "llm_cache")
+    try:
+        try:
+            run = CASES[name](scratch)
+        except Skip as e:
+            print(json.dumps({"skipped": str(e)}))
+            return
+        start = time.perf_counter()
+        stats = run()
+        wall = time.perf_counter() - start
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and bytes on macOS.
+    peak_mb = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    stages = stats.pop("stages", None)
+    result = {"wall_s": round(wall, 4), "peak_rss_mb": round(peak_mb, 1), "stats": stats}
+    if stages:
+        result["stages"] = stages
+    print(json.dumps(result))
+
+
+def measure(name, repeat):
+    """Run a case `repeat` times in fresh processes; keep the fastest run."""
+    best = None
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, "-m", "benchmarks.run_benchmarks", "--child", name],
+            cwd=ROOT, capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "failed"}
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        if "skipped" in result:
+            return result
+        if best is None or result["wall_s"] < best["wall_s"]:
+            best = result
+    return best
+
+
+def machine_info():
+    return {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()}
+
+
+def compare(name, result, baseline):
+    """Status and notes for one case against its baseline entry."""
+    if "error" in result:
+        return "ERROR", result["error"]
+    if "skipped" in result:
+        return "SKIP", result["skipped"]
+    if baseline is None:
+        return "NEW", ""
+
+    notes = []
+    status = "OK"
+    if result["stats"] != baseline["stats"]:
+        status = "CHANGED"
+        notes.append(f"stats {baseline['stats']} -> {result['stats']}")
+    if result["wall_s"] > baseline["wall_s"] * (1 + WALL_TOLERANCE):
+        status = "SLOWER"
+    if result["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + RSS_TOLERANCE):
+        status = "SLOWER" if status == "SLOWER" else "MEMORY"
+    return status, "; ".join(notes)
+
+
+def _delta(value, base):
+    return f"{(value - base) / base * 100:+.0f}%" if base else ""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the offline benchmarks.")
+    parser.add_argument("cases", nargs="*", help="cases to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case; the fastest is kept")
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--check", action="store_true", help="exit 1 when a case regressed or changed")
+    parser.add_argument("--record", action="store_true",
+                        help="call the live Textract API on the samples and save replies for the fakes")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args.child)
+        return 0
+
+    if args.record:
+        from benchmarks.fakes import RECORDINGS_DIR, recording_path
+        from backend.ocr_service import get_textract_client
+
+        os.makedirs(RECORDINGS_DIR, exist_ok=True)
+        for image_path in (PAGE_V2, RINGPOP):
+            name = os.path.splitext(os.path.basename(image_path))[0]
+            with open(image_path, "rb") as f:
+                response = get_textract_client().detect_document_text(Document={"Bytes": f.read()})
+            with open(recording_path("textract", name), "w") as f:
+                json.dump(response, f)
+            print(f"Recorded Textract reply for {name}")
+        return 0
+
+    names = args.cases or list(CASES)
+    unknown = [name for name in names if name not in CASES]
+    if unknown:
+        parser.error(f"unknown case(s): {', '.join(unknown)}")
+
+    baseline = {"cases": {}}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, "r") as f:
+            baseline = json.load(f)
+        if baseline.get("machine") != machine_info():
+            print(f"Note: baseline was recorded on {baseline.get('machine')}; timings may not compare.")
+
+    results = {}
+    failed = False
+    print(f"{'case':<24} {'wall s':>9} {'Δ':>6} {'peak MB':>9} {'Δ':>6}  status")
+    for name in names:
+        result = measure(name, args.repeat)
+        results[name] = result
+        base = baseline["cases"].get(name)
+        status, notes = compare(name, result, base)
+        failed = failed or status in ("SLOWER", "MEMORY", "CHANGED", "ERROR")
+        if "wall_s" in result:
+            print(f"{name:<24} {result['wall_s']:>9.3f} {_delta(result['wall_s'], base['wall_s']) if base else '':>6} "
+                  f"{result['peak_rss_mb']:>9.1f} {_delta(result['peak_rss_mb'], base['peak_rss_mb']) if base else '':>6}"
+                  f"  {status}  {json.dumps(result['stats'])}")
+            if result.get("stages"):
+                print(f"{'':<24} stages: {json.dumps(result['stages'])}")
+        else:
+            print(f"{name:<24} {'':>9} {'':>6} {'':>9} {'':>6}  {status}")
+        if notes:
+            print(f"{'':<24} {notes}")
+
+    if args.update_baseline:
+        cases = dict(baseline.get("cases", {}))
+        cases.update({name: result for name, result in results.items() if "wall_s" in result})
+        with open(BASELINE_PATH, "w") as f:
+            json.dump({"machine": machine_info(), "cases": cases}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {BASELINE_PATH}")
+        return 0
+    return 1 if args.check and failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())